@@ -1,6 +1,9 @@
 import fiona
+import numpy as np
 
 from building import Building
+from gridIndex import GridIndex
+from misc import batch_line_intersect
 from shapely.strtree import STRtree
 
 class BuildingManager:
@@ -11,6 +14,17 @@ class BuildingManager:
         self.buildings_geometry = []
         self.buildings_tree = None
 
+        # Flat table with the walls of all buildings (see create_wall_table)
+        self.building_ids = []
+        self.building_wall_offsets = None
+        self.wall_starts = None
+        self.wall_ends = None
+        self.wall_line_parameters = None
+        self.wall_buildings = None
+        self.wall_ids = None
+        self.wall_underground = None
+        self.wall_index = None
+
     def read_buildings_shp(self, path_to_shp):
         with fiona.open(path_to_shp) as records:
             for building_info in records:
@@ -30,3 +44,103 @@ class BuildingManager:
 
     def create_rtree(self):
         self.buildings_tree = STRtree(self.buildings_geometry)
+        self.create_wall_table()
+
+    def create_wall_table(self):
+        """
+        Explanation: Stores the walls of all buildings in flat arrays, with a grid index over the walls. The walls of
+        building i (in the order of self.building_ids) are the rows building_wall_offsets[i] up to building_wall_offsets[i + 1],
+        in the same order as building.walls. The outer side of a wall is on its left (positive side test).
+        ---------------
+        Input: void
+        ---------------
+        Output:
+            void (sets the wall_ arrays and self.wall_index)
+        """
+        self.building_ids = list(self.buildings.keys())
+        walls = [wall for building_id in self.building_ids for wall in self.buildings[building_id].walls]
+        wall_counts = np.array([len(self.buildings[building_id].walls) for building_id in self.building_ids], dtype=np.int64)
+        self.building_wall_offsets = np.concatenate(([0], np.cumsum(wall_counts))).astype(np.int64)
+
+        self.wall_starts = np.array([wall[0][:2] for wall in walls], dtype=float).reshape(-1, 2)
+        self.wall_ends = np.array([wall[1][:2] for wall in walls], dtype=float).reshape(-1, 2)
+        self.wall_buildings = np.repeat(np.arange(len(self.building_ids)), wall_counts)
+        self.wall_ids = np.arange(len(walls)) - self.building_wall_offsets[self.wall_buildings]
+
+        # the normalised line equation a * x + b * y + c = 0, computed as in misc.parametric_line_equation
+        direction = self.wall_ends - self.wall_starts
+        a = direction[:, 1]
+        b = -direction[:, 0]
+        c = -a * self.wall_starts[:, 0] - b * self.wall_starts[:, 1]
+        m = np.sqrt(a * a + b * b)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.wall_line_parameters = np.stack((a / m, b / m, c / m), axis=-1)
+
+        underground = np.array([self.buildings[building_id].underground for building_id in self.building_ids], dtype=bool)
+        self.wall_underground = underground[self.wall_buildings]
+
+        self.wall_index = GridIndex(np.concatenate(
+            (np.minimum(self.wall_starts, self.wall_ends), np.maximum(self.wall_starts, self.wall_ends)), axis=1))
+
+    def get_wall(self, wall):
+        """
+        Explanation: Get the building id and the index in building.walls of a wall in the wall table
+        ---------------
+        Input:
+            wall : integer - the row in the wall table
+        ---------------
+        Output:
+            building id, integer - the building and the index of the wall in it
+        """
+        return self.building_ids[self.wall_buildings[wall]], int(self.wall_ids[wall])
+
+    def query_walls(self, bounding_box):
+        """
+        Explanation: Find the walls of which the bounding box overlaps a bounding box
+        ---------------
+        Input:
+            bounding_box : [x_min, y_min, x_max, y_max] - the box to search in
+        ---------------
+        Output:
+            numpy array - the (sorted) rows of the walls in the wall table
+        """
+        return self.wall_index.query(bounding_box)
+
+    def query_walls_radius(self, pt, radius):
+        """
+        Explanation: Find the walls of which the bounding box overlaps the bounding box of a circle
+        ---------------
+        Input:
+            pt : [x, y] - the centre of the circle
+            radius : float - the radius of the circle
+        ---------------
+        Output:
+            numpy array - the (sorted) rows of the walls in the wall table
+        """
+        return self.wall_index.query_radius(pt, radius)
+
+    def rays_hit_buildings(self, ray_starts, ray_ends, buildings):
+        """
+        Explanation: Test for many line segments (rays) at once if they intersect a wall of a building, every ray has its
+        own building. All (ray, wall of its building) pairs are intersected in one array operation.
+        ---------------
+        Input:
+            ray_starts, ray_ends : (n, 2) arrays - the end points of the rays
+            buildings : (n,) integer array - per ray the building (index in self.building_ids) to test against
+        ---------------
+        Output:
+            (n,) boolean array - True where the ray intersects at least one wall of its building
+        """
+        ray_starts = np.asarray(ray_starts, dtype=float).reshape(-1, 2)
+        ray_ends = np.asarray(ray_ends, dtype=float).reshape(-1, 2)
+        buildings = np.asarray(buildings, dtype=np.int64)
+
+        # expand to (ray, wall) pairs
+        first_walls = self.building_wall_offsets[buildings]
+        wall_counts = self.building_wall_offsets[buildings + 1] - first_walls
+        ray_ids = np.repeat(np.arange(len(buildings)), wall_counts)
+        pair_start = np.repeat(np.cumsum(wall_counts) - wall_counts, wall_counts)
+        walls = np.repeat(first_walls, wall_counts) + np.arange(len(ray_ids)) - pair_start
+
+        _, intersects, _ = batch_line_intersect(self.wall_starts[walls], self.wall_ends[walls], ray_starts[ray_ids], ray_ends[ray_ids])
+        return np.bincount(ray_ids[intersects], minlength=len(buildings)) > 0
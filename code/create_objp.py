@@ -1,99 +1,320 @@
+import groundTin as TIN
+import hashlib
 import json
+import misc
+import numpy as np
+import re
 import sys
 
 from pathlib import Path
 
+# The closing bracket of the last row of a list of lists, followed by the closing bracket of the list itself
+JSON_LIST_END = re.compile(r"\]\s*\]")
+
+def build_adjacency(triangles):
+    """
+    Explanation: Find the neighbouring triangles of all triangles, by sorting all edges on their (sorted) vertex ids
+    and pairing the equal edges. When more than two triangles share an edge, the first triangle is the neighbour of
+    all others, and the last one is the neighbour of the first.
+    ---------------
+    Input:
+        triangles : (n, 3) array - the vertex ids of the triangles
+    ---------------
+    Output:
+        (n, 6) numpy array - [v1, v2, v3, n0, n1, n2] per triangle, where the neighbour is -1 if there is none
+    """
+    triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+    triangle_count = len(triangles)
+    result = np.full((triangle_count, 6), -1, dtype=np.int64)
+    result[:, :3] = triangles
+    if triangle_count == 0:
+        return result
+
+    # The edges (v1, v2), (v2, v3) and (v1, v3) are stored at neighbour index 5, 3 and 4
+    edges = np.stack((triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [0, 2]]), axis=1).reshape(-1, 2)
+    edges.sort(axis=1)
+    edge_triangle = np.repeat(np.arange(triangle_count), 3)
+    edge_slot = np.tile([5, 3, 4], triangle_count)
+
+    # Sort the edges, triangles with the same edge end up next to each other (in order of triangle id)
+    order = np.lexsort((edges[:, 1], edges[:, 0]))
+    sorted_edges = edges[order]
+    new_group = np.ones(len(order), dtype=bool)
+    new_group[1:] = np.any(sorted_edges[1:] != sorted_edges[:-1], axis=1)
+    group_start = np.nonzero(new_group)[0]
+    group_size = np.diff(np.append(group_start, len(order)))
+
+    # every edge that is not the first of its group has the first triangle as neighbour
+    first_of_edge = np.repeat(group_start, group_size)
+    others = np.nonzero(~new_group)[0]
+    result[edge_triangle[order[others]], edge_slot[order[others]]] = edge_triangle[order[first_of_edge[others]]]
+
+    # the first triangle has the last triangle of the group as neighbour
+    shared = group_size > 1
+    first = order[group_start[shared]]
+    last = order[group_start[shared] + group_size[shared] - 1]
+    result[edge_triangle[first], edge_slot[first]] = edge_triangle[last]
+
+    return result
+
+class JsonStream:
+
+    def __init__(self, input_file, chunk_size = 1 << 20):
+        """
+        Reads a json document piece by piece from an open text file, so only the value that is being read
+        has to be in memory, instead of the whole document.
+        """
+        self.input_file = input_file
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.position = 0
+        self.at_end = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        """
+        Explanation: Drop the part of the buffer that has been read and append the next chunk of the file.
+        ---------------
+        Input: void
+        ---------------
+        Output:
+            Boolean - False if the end of the file has been reached.
+        """
+        chunk = self.input_file.read(self.chunk_size)
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        if not chunk:
+            self.at_end = True
+        return not self.at_end
+
+    def peek(self):
+        """
+        Explanation: Skip the whitespace and return the next character, without reading it.
+        ---------------
+        Input: void
+        ---------------
+        Output:
+            string - the next character, empty at the end of the file.
+        """
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in " \t\n\r":
+                self.position += 1
+            if self.position < len(self.buffer) or not self.fill():
+                return self.buffer[self.position:self.position + 1]
+
+    def expect(self, character):
+        """
+        Explanation: Read the next character, which has to be the given character.
+        ---------------
+        Input:
+            character : string - the expected character.
+        ---------------
+        Output: void
+        """
+        if self.peek() != character:
+            raise ValueError("expected '{}' in json, found '{}'".format(character, self.peek()))
+        self.position += 1
+
+    def read_value(self):
+        """
+        Explanation: Read the next json value (object, list, string or number) completely.
+        ---------------
+        Input: void
+        ---------------
+        Output:
+            the python version of the value
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+                # a value that stops at the end of the buffer (a number) could continue in the next chunk
+                if end < len(self.buffer) or self.at_end:
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.at_end:
+                    raise
+            self.fill()
+
+    def read_members(self):
+        """
+        Explanation: Go over the members of a json object, yields the key of every member. The caller has to
+        read (or skip) the value before asking for the next key.
+        ---------------
+        Input: void
+        ---------------
+        Output:
+            generator - the keys of the object
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.position += 1
+            return
+        while True:
+            key = self.read_value()
+            self.expect(':')
+            yield key
+            if self.peek() == ',':
+                self.position += 1
+            else:
+                self.expect('}')
+                return
+
+    def read_number_array(self, columns):
+        """
+        Explanation: Read a list of lists of numbers (like the vertices) straight into a numpy array,
+        without creating a python list for every row.
+        ---------------
+        Input:
+            columns : integer - the length of the inner lists
+        ---------------
+        Output:
+            (n, columns) numpy array - the numbers
+        """
+        separators = str.maketrans("[],", "   ")
+        parts = []
+        self.expect('[')
+        if self.peek() == ']':
+            self.position += 1
+            return np.zeros((0, columns))
+
+        while True:
+            # the end of the list is the closing bracket of the last row, followed by the closing bracket of the list
+            end = JSON_LIST_END.search(self.buffer, self.position)
+            if end is not None:
+                parts.append(np.fromstring(self.buffer[self.position:end.start()].translate(separators), sep=' '))
+                self.position = end.end()
+                break
+            # convert all complete rows in the buffer, and get the next chunk
+            last_row_end = self.buffer.rfind("],", self.position)
+            if last_row_end != -1:
+                parts.append(np.fromstring(self.buffer[self.position:last_row_end].translate(separators), sep=' '))
+                self.position = last_row_end + 1
+            if not self.fill():
+                raise ValueError("unexpected end of json in a list of numbers")
+
+        return np.concatenate(parts).reshape(-1, columns)
+
+    def skip_value(self):
+        """
+        Explanation: Read the next value, without keeping it.
+        ---------------
+        Input: void
+        ---------------
+        Output: void
+        """
+        self.read_value()
+
 class json_parse:
 
     def __init__(self):
-        self.vts = []
-        self.trs = []
-        self.attr = []
+        self.vts = np.zeros((0, 3))
+        self.trs = np.zeros((0, 6), dtype=np.int64)
+        self.attr = np.zeros(0, dtype=np.int32)
+        self.attribute_names = []
+
+        self.triangle_count = 0
+        self.attribute_codes = {}
+        self.id_value = None
+
+    def add_triangle(self, triangle, id_value):
+        """
+        Explanation: Store a triangle and the code of its attribute, the arrays grow by doubling their size.
+        ---------------
+        Input:
+            triangle : [v1, v2, v3] - the vertex ids of the triangle
+            id_value : string - the attribute of the triangle ('b<part_id>' / 'g<index>')
+        ---------------
+        Output: void
+        """
+        if self.triangle_count == len(self.trs):
+            capacity = max(1024, 2 * len(self.trs))
+            self.trs = np.resize(self.trs, (capacity, 3))
+            self.attr = np.resize(self.attr, capacity)
+
+        if id_value not in self.attribute_codes:
+            self.attribute_codes[id_value] = len(self.attribute_names)
+            self.attribute_names.append(id_value)
 
-        self.edges = {}
+        self.trs[self.triangle_count] = triangle[:3]
+        self.attr[self.triangle_count] = self.attribute_codes[id_value]
+        self.triangle_count += 1
 
     def read_json(self, file_path):
-                
+        """
+        Explanation: Read the triangles of a cityjson file, in which every boundary is a triangle. The city objects
+        are read one by one, so the whole json does not have to fit in memory.
+        ---------------
+        Input:
+            file_path : string - The path to the cityjson file.
+        ---------------
+        Output: void (fills self.vts, self.trs and self.attr)
+        """
+        self.trs = np.zeros((0, 3), dtype=np.int64)
+        self.attr = np.zeros(0, dtype=np.int32)
+        self.triangle_count = 0
+
         with open(file_path, 'r') as json_input_file:
-            lines = json_input_file.readlines()
-            #Load the json
-            json_string = lines[0]
-            json_dict = json.loads(json_string)
-
-            #Assign the vertices
-            self.vts = json_dict["vertices"]
-
-            #Run through all the city json objects
-            objects = json_dict["CityObjects"]
-            for uuid in objects:
-                constrained_object = objects[uuid]
-                #print(constrained_object)
-                # Get the attributes of this object
-                attributes = constrained_object["attributes"]
-
-                if 'bodemfactor' in attributes.keys():
-                    id_value = 'g' + attributes["bodemfactor"]
-                elif 'bodemfacto' in attributes.keys():
-                    id_value = 'g' + attributes["bodemfacto"]
-
-                #Get the identificatie of this object
-                if 'part_id' in attributes.keys():
-                    part_id = attributes["part_id"]
-                    #If the identificatie is not empty, it is a building and this is the id used to identify the object
-                    if part_id != '':
-                        id_value = 'b' + part_id
-                
-                object_geoms = constrained_object['geometry']
-                for object_geom in object_geoms:
-                    object_boundaries = object_geom['boundaries']
-
-                    for boundary in object_boundaries:
-                        for triangle in boundary:
-                            v1 = triangle[0]
-                            v2 = triangle[1]
-                            v3 = triangle[2]
-                            face = [v1, v2, v3, -1, -1, -1]
-
-                            #The index this triangle will be at
-                            tri_index = len(self.trs)
-
-                            edge1 = [v1, v2]
-                            edge1.sort()
-                            edge1 = (edge1[0], edge1[1])
-                            
-                            edge2 = [v2, v3]
-                            edge2.sort()
-                            edge2 = (edge2[0], edge2[1])
-
-                            edge3 = [v1, v3]
-                            edge3.sort()
-                            edge3 = (edge3[0], edge3[1])
-
-                            tri_edges = [edge1, edge2, edge3]
-
-                            #Loop through all edges
-                            inc_tri = [5, 3, 4]
-                            count = 0
-                            for tri_edge in tri_edges:
-                                #Check if this edge already exists in the edges dict
-                                if tri_edge in self.edges.keys():
-                                    edge_value = self.edges[tri_edge]
-
-                                    face[inc_tri[count]] = edge_value[0]
-                                    self.trs[edge_value[0]][edge_value[1]] = tri_index
-                                #If this edge was not in the edges yet, add it as one
-                                else:
-                                    self.edges[tri_edge] = [tri_index, inc_tri[count]]
-                                
-                                count = count + 1
-
-                            #Append the face and the attribute of that face
-                            self.trs.append(face)
-                            self.attr.append(id_value)
+            json_stream = JsonStream(json_input_file)
+
+            for key in json_stream.read_members():
+                #Assign the vertices
+                if key == "vertices":
+                    self.vts = json_stream.read_number_array(3)
+
+                #Run through all the city json objects
+                elif key == "CityObjects":
+                    for uuid in json_stream.read_members():
+                        constrained_object = json_stream.read_value()
+                        self.read_city_object(constrained_object)
+
+                else:
+                    json_stream.skip_value()
+
+        self.trs = self.trs[:self.triangle_count]
+        self.attr = self.attr[:self.triangle_count]
+
+        #Find the neighbours of all triangles at once
+        self.trs = build_adjacency(self.trs)
+
+    def read_city_object(self, constrained_object):
+        """
+        Explanation: Store the triangles of one city object with the attribute of the object.
+        ---------------
+        Input:
+            constrained_object : dictionary - the city object
+        ---------------
+        Output: void
+        """
+        #print(constrained_object)
+        # Get the attributes of this object
+        attributes = constrained_object["attributes"]
+
+        if 'bodemfactor' in attributes.keys():
+            self.id_value = 'g' + attributes["bodemfactor"]
+        elif 'bodemfacto' in attributes.keys():
+            self.id_value = 'g' + attributes["bodemfacto"]
+
+        #Get the identificatie of this object
+        if 'part_id' in attributes.keys():
+            part_id = attributes["part_id"]
+            #If the identificatie is not empty, it is a building and this is the id used to identify the object
+            if part_id != '':
+                self.id_value = 'b' + part_id
+
+        object_geoms = constrained_object['geometry']
+        for object_geom in object_geoms:
+            object_boundaries = object_geom['boundaries']
+
+            for boundary in object_boundaries:
+                for triangle in boundary:
+                    #Append the face and the attribute of that face
+                    self.add_triangle(triangle, self.id_value)
 
     def write_to_objp(self, file_path): #, id_to_attr):
         """
-        Explination: Writes out the tin to an objp file.
+        Explination: Writes out the tin to an objp file, if the file ends with .gz it is compressed.
         ---------------
         Input:
             file_path : string - The path to the obj file we want to write to.
@@ -102,31 +323,14 @@ class json_parse:
         """
         print("=== write to file {} ===".format(file_path))
 
-        with open(file_path, 'w+') as output_file:
-            for vertex in self.vts:
-                vertex_str = "v " + str(vertex[0]) + " " + str(vertex[1]) + " " + str(vertex[2]) + "\n"
-                output_file.write(vertex_str)
-
-            for triangle in self.trs:
-                triangle_str = "f " + str(triangle[0] + 1) + " " + str(triangle[1] + 1) + " " + str(
-                    triangle[2] + 1) + " " + str(triangle[3] + 1) + " " + str(triangle[4] + 1) + " " + str(
-                    triangle[5] + 1) + "\n"
-                output_file.write(triangle_str)
-
-            for attribute in self.attr:
-                attribute_str = "a " + attribute + "\n"
-                output_file.write(attribute_str)
-                
-                #if attribute[0] != 0.0:
-                #    attribute_str = "a " + id_to_attr[int(attribute[0])] + "\n"
-                #    output_file.write(attribute_str)
-                #else:
-                #    attribute_str = "a " + id_to_attr[1001] + "\n"
-                #    output_file.write(attribute_str)
+        with misc.open_text_file(file_path, 'w') as output_file:
+            misc.write_rows(output_file, "v %r %r %r\n", self.vts)
+            misc.write_rows(output_file, "f %d %d %d %d %d %d\n", self.trs + 1)
+            misc.write_rows(output_file, "a %s\n", np.array(self.attribute_names)[self.attr])
 
     def write_to_obj(self, file_path): #, id_to_attr):
         """
-        Explination: Writes out the tin to an objp file.
+        Explination: Writes out the tin to an obj file, if the file ends with .gz it is compressed.
         ---------------
         Input:
             file_path : string - The path to the obj file we want to write to.
@@ -135,26 +339,60 @@ class json_parse:
         """
         print("=== write to file {} ===".format(file_path))
 
-        with open(file_path, 'w+') as output_file:
-            for vertex in self.vts:
-                vertex_str = "v " + str(vertex[0]) + " " + str(vertex[1]) + " " + str(vertex[2]) + "\n"
-                output_file.write(vertex_str)
+        with misc.open_text_file(file_path, 'w') as output_file:
+            misc.write_rows(output_file, "v %r %r %r\n", self.vts)
+            misc.write_rows(output_file, "f %d %d %d\n", self.trs[:, :3] + 1)
+
+def read_from_cityjson(file_path, cache_folder):
+    """
+    Explanation: Make a tin from a cityjson file. The converted tin is stored in the cache folder as a binary tin,
+    named after a hash of the cityjson file, so the next time the same file is used the conversion is skipped.
+    ---------------
+    Input:
+        file_path : string - The path to the cityjson file.
+        cache_folder : string - The folder with the converted tins.
+    ---------------
+    Output:
+        ground_tin : GroundTin - The tin that was created from the cityjson file.
+    """
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as json_input_file:
+        for chunk in iter(lambda: json_input_file.read(1 << 20), b""):
+            file_hash.update(chunk)
+
+    Path(cache_folder).mkdir(parents=True, exist_ok=True)
+    cache_file_path = Path(cache_folder) / "{}_v{}.tinb".format(file_hash.hexdigest(), TIN.BINARY_TIN_VERSION)
+    if cache_file_path.exists():
+        return TIN.read_from_binary(str(cache_file_path))
+
+    jp = json_parse()
+    jp.read_json(file_path)
+    ground_tin = TIN.GroundTin(jp.vts, jp.trs, jp.attr, attribute_names=jp.attribute_names)
+    ground_tin.bounding_box_3d = [float(value) for value in np.concatenate((jp.vts.min(axis=0), jp.vts.max(axis=0)))]
+    ground_tin.bounding_box_2d = [ground_tin.bounding_box_3d[i] for i in (0, 1, 3, 4)]
+
+    # write to a temporary file first, so an interrupted run does not leave a broken file in the cache
+    temporary_file_path = cache_file_path.with_suffix(".tmp")
+    ground_tin.write_to_binary(str(temporary_file_path))
+    temporary_file_path.replace(cache_file_path)
+
+    return ground_tin
 
-            for triangle in self.trs:
-                triangle_str = "f " + str(triangle[0] + 1) + " " + str(triangle[1] + 1) + " " + str(
-                    triangle[2] + 1) + "\n"
-                output_file.write(triangle_str)
+if __name__ == "__main__":
+    jp = json_parse()
 
-jp = json_parse()
+    json_file_path = sys.argv[1]
+    jp.read_json(json_file_path)
 
-json_file_path = sys.argv[1]
-jp.read_json(json_file_path)
+    output_file_path = sys.argv[2]
+    Path(output_file_path).mkdir(parents=True, exist_ok=True)
 
-output_file_path = sys.argv[2]
-Path(output_file_path).mkdir(parents=True, exist_ok=True)
+    objp_output_file = output_file_path + "/constrainted_tin.objp"
+    jp.write_to_objp(objp_output_file)
 
-objp_output_file = output_file_path + "/constrainted_tin.objp"
-jp.write_to_objp(objp_output_file)
+    obj_output_file = output_file_path + "/constrainted_tin.obj"
+    jp.write_to_obj(obj_output_file)
 
-obj_output_file = output_file_path + "/constrainted_tin.obj"
-jp.write_to_obj(obj_output_file)
\ No newline at end of file
+    # The binary version of the objp, which main.py can open without parsing
+    tinb_output_file = output_file_path + "/constrainted_tin.tinb"
+    TIN.write_binary(tinb_output_file, jp.vts, jp.trs, jp.attr, jp.attribute_names)
\ No newline at end of file
@@ -1,19 +1,118 @@
 import misc
 import numpy as np
+import sys
 
 from pprint import pprint
 
+# the materials of the vertices are stored as codes, an index in this list
+MATERIALS = ["G", "C", "A0"]
+MATERIAL_CODES = {material: code for code, material in enumerate(MATERIALS)}
+
+# the extensions (source, receiver and reflections) of a cross section, "length" is only used by the source
+# and "material" only by the walls
+EXTENSION_TYPES = ["source", "receiver", "wall"]
+EXTENSION_DTYPE = np.dtype([
+    ("vertex", "<u4"),
+    ("type", "u1"),
+    ("height", "<f8"),
+    ("length", "<f8"),
+    ("material", "u1")
+])
+
 class CrossSection:
 
+    # a cross section is kept for every path of every receiver, so it is stored compactly; the vertices as a (n, 3) array,
+    # the materials as codes and the extension as a structured array. The properties convert them to the original lists and dictionary.
+    # For the paths of the sample data (about 50 vertices) this is about 5 times smaller than the lists, most of what is left
+    # are the 24 bytes per float64 vertex, so it is not an order of magnitude.
+    __slots__ = ("points_to_source", "reflection_heights", "receiver", "source", "vertex_array", "material_codes", "extension_array")
+
     def __init__(self, points_to_source, receiver, source, reflection_heights):
         self.points_to_source = points_to_source
         self.reflection_heights = reflection_heights
         self.receiver = receiver
         self.source = source
         
-        self.vertices = []
-        self.materials = []
-        self.extension = {}
+        self.vertex_array = np.empty((0, 3))
+        self.material_codes = np.empty(0, dtype=np.uint8)
+        self.extension_array = np.empty(0, dtype=EXTENSION_DTYPE)
+
+    @property
+    def vertices(self):
+        """
+        Explanation: The vertices of the cross section, from the source to the receiver
+        ---------------
+        Output:
+            list - tuple(x, y, z) per vertex
+        """
+        return [tuple(vertex) for vertex in self.vertex_array.tolist()]
+
+    @vertices.setter
+    def vertices(self, vertices):
+        # copy, so the array owns its data (a reshaped array is a view of another array object)
+        self.vertex_array = np.array(vertices, dtype=float).reshape(-1, 3).copy()
+
+    @property
+    def materials(self):
+        """
+        Explanation: The materials of the vertices of the cross section
+        ---------------
+        Output:
+            list - material string ("G", "C" or "A0") per vertex
+        """
+        return [MATERIALS[code] for code in self.material_codes.tolist()]
+
+    @materials.setter
+    def materials(self, materials):
+        self.material_codes = np.array([MATERIAL_CODES[material] for material in materials], dtype=np.uint8)
+
+    @property
+    def extension(self):
+        """
+        Explanation: The extensions of the cross section, as used by the XmlParser
+        ---------------
+        Output:
+            dictionary - vertex id: ["source", height, source length], ["receiver", height] or ["wall", height, material]
+        """
+        extension = {}
+        for vertex, extension_type, height, length, material in self.extension_array.tolist():
+            if EXTENSION_TYPES[extension_type] == "source":
+                extension[vertex] = ["source", height, length]
+            elif EXTENSION_TYPES[extension_type] == "receiver":
+                extension[vertex] = ["receiver", height]
+            else:
+                extension[vertex] = [EXTENSION_TYPES[extension_type], height, MATERIALS[material]]
+        return extension
+
+    @extension.setter
+    def extension(self, extension):
+        self.extension_array = np.zeros(len(extension), dtype=EXTENSION_DTYPE)
+        for i, (vertex, value) in enumerate(extension.items()):
+            self.extension_array[i]["vertex"] = vertex
+            self.extension_array[i]["type"] = EXTENSION_TYPES.index(value[0])
+            self.extension_array[i]["height"] = value[1]
+            if value[0] == "source":
+                self.extension_array[i]["length"] = value[2]
+            elif len(value) > 2:
+                self.extension_array[i]["material"] = MATERIAL_CODES[value[2]]
+
+    def get_memory(self):
+        """
+        Explanation: The memory used by the cross section, the object itself and its arrays with their headers.
+        The points_to_source, receiver and source are shared with other objects and not counted.
+        ---------------
+        Input: void
+        ---------------
+        Output:
+            integer - bytes
+        """
+        memory = sys.getsizeof(self)
+        for array in (self.vertex_array, self.material_codes, self.extension_array):
+            # getsizeof only counts the data of an array that owns it
+            memory += sys.getsizeof(array)
+            if array.base is not None:
+                memory += array.nbytes
+        return memory
 
     def get_next_edge(self, ground_tin, tr, origin, destination):
         """
@@ -32,12 +131,19 @@ class CrossSection:
             (ground_tin.trs[tr][1], ground_tin.trs[tr][2]),
             (ground_tin.trs[tr][2], ground_tin.trs[tr][0])
             )
-        # Go over the edges
-        for i, edge in enumerate(edges):
-            # Check if the orientation is correct
-            if (misc.side_test(origin, destination, ground_tin.vts[edge[0]]) <= 0 and
-                    misc.side_test(origin, destination, ground_tin.vts[edge[1]]) > 0):
-                return i, edge
+        if ground_tin.triangle_vertices is not None:
+            # read the precomputed row once, the side tests are done with python floats
+            sides = [misc.side_test(origin, destination, vertex) for vertex in ground_tin.triangle_vertices[tr].tolist()]
+            for i, edge in enumerate(edges):
+                if sides[i] <= 0 and sides[(i + 1) % 3] > 0:
+                    return i, edge
+        else:
+            # Go over the edges
+            for i, edge in enumerate(edges):
+                # Check if the orientation is correct
+                if (misc.side_test(origin, destination, ground_tin.vts[edge[0]]) <= 0 and
+                        misc.side_test(origin, destination, ground_tin.vts[edge[1]]) > 0):
+                    return i, edge
         
         print("something went wrong here")
         assert(False)
@@ -56,16 +162,40 @@ class CrossSection:
             string - material type
             integer - attribute id of the building, or -1 if it is ground
         """
-        if tin.attributes[tr][0] == 'b':
-            building_id = tin.attributes[tr]
-            return "A0", building_id
-        elif tin.attributes[tr][0] == 'g':
-            if(tin.attributes[tr][1] == "0"):
-                return "G", -1
-            else:
-                return "C", -1
+        return tin.get_material(tr)
 
-    def get_cross_section(self, current_triangle, ground_tin, ground_type_manager, building_manager, source_height, receiver_height):
+    def walk(self, ground_tin, current_triangle, origin, destination):
+        """
+        Explanation: Walks from the current triangle to the triangle of the destination, along the line origin -> destination
+        ---------------
+        Input:
+            ground_tin : GroundTin object - stores the DTM in a triangle datastructure
+            current_triangle : integer - the triangle we walk from, it contains the origin
+            origin : tuple(x,y) - the point we walk from
+            destination : tuple(x,y) - the point we walk to
+        ---------------
+        Output:
+            generator - per crossed edge (crossing point (x, y, z), triangle before, triangle after)
+        """
+        # define the neighbour ids
+        nbs = [5, 3, 4] # -> [v0, v1, v2, n0, n1, n2]
+
+        while not ground_tin.point_in_triangle(destination, current_triangle):
+            # Make sure that we have not gotten of the TIN
+            assert (current_triangle != -1)
+
+            # Get the outgoing edge of the triangle
+            edge_id, edge = self.get_next_edge(ground_tin, current_triangle, origin, destination)
+
+            # get intersection point between edge and receiver-source segment
+            interpolated_point = ground_tin.intersection_point(edge, destination, origin)
+
+            # move triangle to the next triangle in the path
+            next_triangle = ground_tin.trs[current_triangle][nbs[edge_id]]
+            yield interpolated_point, current_triangle, next_triangle
+            current_triangle = next_triangle
+
+    def get_cross_section(self, current_triangle, ground_tin, ground_type_manager, building_manager, source_height, receiver_height, crossings=None, receiver_height_ground=None):
         """
         Explanation: Finds cross-section while walking to the source point
         ---------------
@@ -74,20 +204,20 @@ class CrossSection:
             ground_tin : GroundTin object - stores the DTM in a triangle datastructure
             ground_type_manager : GroundTypeManager object - stores all the groundtype objects
             building_manager : BuildingManager object - stores all the building objects
+            crossings : list - optional, the crossings (see walk) from the receiver to the first point, when already walked
+            receiver_height_ground : float - optional, the height of the tin at the receiver, when already computed
         ---------------
         Output:
             void (saves the DSM, materials and extension in the class)
         """
         #print("=== cross_section ===")
-        # define the neighbour ids
-        nbs = [5, 3, 4] # -> [v0, v1, v2, n0, n1, n2]
-
         # initialize extension, holds information about receiver, reflections and source.
         extension = {}
-        reflection_point_id_inversed = 0
+        reflection_point_ids_inversed = []
 
         # the first vertex is the receiver projected into its triangle
-        receiver_height_ground = ground_tin.interpolate_triangle(current_triangle, self.receiver)
+        if receiver_height_ground is None:
+            receiver_height_ground = ground_tin.interpolate_triangle(current_triangle, self.receiver)
 
         # get the material of the current triangle
         material_triangle, material_id = self.get_material(ground_tin, building_manager, ground_type_manager, current_triangle)
@@ -99,22 +229,16 @@ class CrossSection:
         origin = self.receiver
 
         for destination_id, destination in enumerate(self.points_to_source):
-            # keep going untill the source triangle has been found.
-            while not ground_tin.point_in_triangle(destination, current_triangle):
-                # Make sure that we have not gotten of the TIN
-                assert (current_triangle != -1)
-
-                # Get the outgoing edge of the triangle
-                edge_id, edge = self.get_next_edge(ground_tin, current_triangle, origin, destination)
+            # the crossings of the first part can already be walked (for many paths at once, see GroundTin.walk_segments)
+            if destination_id == 0 and crossings is not None:
+                walk = crossings
+            else:
+                walk = self.walk(ground_tin, current_triangle, origin, destination)
 
-                # get intersection point between edge and receiver-source segment
-                interpolated_point = ground_tin.intersection_point(edge, destination, origin)
-                
+            # keep going untill the source triangle has been found.
+            for interpolated_point, previous_triangle, current_triangle in walk:
                 current_material, current_building_id = self.get_material(ground_tin, building_manager, ground_type_manager,
-                                                                        current_triangle)
-
-                # move triangle to the next triangle in the path
-                current_triangle = ground_tin.trs[current_triangle][nbs[edge_id]]
+                                                                        previous_triangle)
 
                 # Get the material and building_id of next building
                 next_material, next_building_id = self.get_material(ground_tin, building_manager, ground_type_manager,
@@ -234,12 +358,13 @@ class CrossSection:
             if(destination_id != len(self.points_to_source)-1):
                 # set the reflection point to the origin
                 origin = destination
-                # get the height of the tin at the reflection point
-
+                # get the height of the tin at the reflection point, or the roof of the building the reflection point is on.
+                # the building is the one of the triangle of the reflection point, the building of the last crossed edge
+                # (next_building_id) can be from another part of the path, or not set when no edge was crossed.
                 reflection_ground_material, building_id = self.get_material(ground_tin, building_manager, ground_type_manager, current_triangle)
 
                 if(building_id != -1):
-                    reflection_height_ground = building_manager.buildings[next_building_id].roof_level
+                    reflection_height_ground = building_manager.buildings[building_id].roof_level
                 else:
                     reflection_height_ground = ground_tin.interpolate_triangle(current_triangle, destination)
 
@@ -247,7 +372,7 @@ class CrossSection:
                 material.append(reflection_ground_material)
 
                 # save the refleciton point to store the extension at the end.
-                reflection_point_id_inversed = len(cross_section_vertices)-1
+                reflection_point_ids_inversed.append(len(cross_section_vertices)-1)
 
         # Reached source triangle, add this point as well.
         source_height_ground = ground_tin.interpolate_triangle(current_triangle, destination)
@@ -264,10 +389,11 @@ class CrossSection:
         extension[0] = ["source", source_height, source_length]
         extension[len(cross_section_vertices) - 1] = ["receiver", receiver_height]
 
-        # Add the reflection (path is inversed, so also the location of the extension needs to be inversed.)
-        if(reflection_point_id_inversed != 0):
+        # Add the reflections (path is inversed, so also the location of the extension needs to be inversed.)
+        # the reflection heights are in the same order as the reflection points, from the receiver to the source
+        for reflection_id, reflection_point_id_inversed in enumerate(reflection_point_ids_inversed):
             reflection_vertex = len(cross_section_vertices) - 1 - reflection_point_id_inversed
-            extension[reflection_vertex] = ["wall", self.reflection_heights[0] - cross_section_vertices[reflection_vertex][2], "A0"]
+            extension[reflection_vertex] = ["wall", self.reflection_heights[reflection_id] - cross_section_vertices[reflection_vertex][2], "A0"]
 
         self.vertices = cross_section_vertices
         self.materials = material
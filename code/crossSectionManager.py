@@ -8,26 +8,71 @@ class CrossSectionManager:
 
     def __init__(self, source_default_height, receiver_default_height):
         self.cross_sections = {}
-        self.receiver_triangles = {}
+
+        # filled by locate_receivers; the row of every receiver, its triangle, its ground height and whether it is valid (not in a building)
+        self.receiver_ids = {}
+        self.receiver_triangles = np.zeros(0, dtype=np.int64)
+        self.receiver_ground_heights = []
+        self.receiver_valid = np.zeros(0, dtype=bool)
 
         self.source_default_height = source_default_height
         self.receiver_default_height = receiver_default_height
     
-    def get_cross_section(self, receiver_coords, source, path, tin, ground_type_manager, building_manager, source_height, receiver_height, reflection_heights=0):
-        #Find the triangle of the tin in which the receiver is located.
-        if receiver_coords in self.receiver_triangles.keys():
-            receiver_triangle = self.receiver_triangles[receiver_coords]
-        else:
-            init_tr = tin.find_vts_near_pt(receiver_coords)
-            receiver_triangle = tin.find_receiver_triangle(init_tr, receiver_coords)
-            # Make sure the receiver triangle is not in a building, this is not valid. if so, exclude it
-            if(tin.attributes[receiver_triangle][0] == 'b'):
-                return 
-            self.receiver_triangles[receiver_coords] = receiver_triangle
+    def locate_receivers(self, receiver_points, tin):
+        """
+        Explanation: Find the triangle of the tin of all receivers at once, before the cross sections are made.
+        Receivers in a building are marked as not valid, no cross sections are made for them.
+        ---------------
+        Input:
+            receiver_points : dictionary - receiver coordinates: ReceiverPoint
+            tin : GroundTin object - stores the DTM in a triangle datastructure
+        ---------------
+        Output: void (fills self.receiver_ids, self.receiver_triangles, self.receiver_ground_heights and self.receiver_valid)
+        """
+        receiver_coords = np.array([coords[:2] for coords in receiver_points.keys()], dtype=float).reshape(-1, 2)
+        self.receiver_ids = {coords: i for i, coords in enumerate(receiver_points.keys())}
+        self.receiver_triangles = tin.find_receiver_triangles(tin.find_vts_near_pts(receiver_coords), receiver_coords)
+        # the receiver triangle can not be in a building, this is not valid.
+        self.receiver_valid = ~tin.attribute_in_building[tin.attributes[self.receiver_triangles]]
+        # the height of the tin at all receivers, the first vertex of their cross sections
+        self.receiver_ground_heights = tin.interpolate_triangles(self.receiver_triangles, receiver_coords).tolist()
+
+    def get_receiver_triangle(self, receiver_coords, tin):
+        """
+        Explanation: Get the triangle of the receiver found by locate_receivers, a receiver that was not located is found now.
+        ---------------
+        Input:
+            receiver_coords : tuple(x,y) - the receiver
+            tin : GroundTin object - stores the DTM in a triangle datastructure
+        ---------------
+        Output:
+            integer - the triangle id, or None when the receiver is in a building
+        """
+        if receiver_coords in self.receiver_ids:
+            receiver_id = self.receiver_ids[receiver_coords]
+            if not self.receiver_valid[receiver_id]:
+                return None
+            return self.receiver_triangles[receiver_id]
+
+        init_tr = tin.find_vts_near_pt(receiver_coords)
+        receiver_triangle = tin.find_receiver_triangle(init_tr, receiver_coords)
+        if(tin.in_building(receiver_triangle)):
+            return None
+        return receiver_triangle
+
+    def get_cross_section(self, receiver_coords, source, path, tin, ground_type_manager, building_manager, source_height, receiver_height, reflection_heights=0, crossings=None):
+        #Get the triangle of the tin in which the receiver is located, if it is in a building it is not valid, exclude it
+        receiver_triangle = self.get_receiver_triangle(receiver_coords, tin)
+        if receiver_triangle is None:
+            return
+
+        receiver_height_ground = None
+        if receiver_coords in self.receiver_ids:
+            receiver_height_ground = self.receiver_ground_heights[self.receiver_ids[receiver_coords]]
 
         cross_section = CrossSection(path, receiver_coords, source, reflection_heights)
         #Create the cross section from the receiver to the source point        
-        cross_section.get_cross_section(receiver_triangle, tin, ground_type_manager, building_manager, source_height, receiver_height)
+        cross_section.get_cross_section(receiver_triangle, tin, ground_type_manager, building_manager, source_height, receiver_height, crossings, receiver_height_ground)
 
         if receiver_coords not in self.cross_sections.keys():
             self.cross_sections[receiver_coords] = []
@@ -41,32 +86,37 @@ class CrossSectionManager:
         # find where the intermediate sources lie in the 'complete' cross-section
 
         source_coords = source_point.source_coords
+        # bisect compares the vertices as tuples
+        vertices = cross_section.vertices
 
         # check if the cross section is going in the positive or negative direction
-        if cross_section.vertices[-1][0] - cross_section.vertices[0][0] < 0:
-            split_idx = reverse_bisect_left(cross_section.vertices, source_coords)
+        if vertices[-1][0] - vertices[0][0] < 0:
+            split_idx = reverse_bisect_left(vertices, source_coords)
 
         # if the path is parallel with the x axis, check if the y axis is in negative direction.
-        elif cross_section.vertices[-1][0] - cross_section.vertices[0][0] == 0 and cross_section.vertices[-1][1] - cross_section.vertices[0][1] < 0:
-            split_idx = reverse_bisect_left(cross_section.vertices, source_coords)
+        elif vertices[-1][0] - vertices[0][0] == 0 and vertices[-1][1] - vertices[0][1] < 0:
+            split_idx = reverse_bisect_left(vertices, source_coords)
 
         # the x direction is positive, or y is in positive direction
         else:
-            split_idx = bisect.bisect_left(cross_section.vertices, source_coords)
+            split_idx = bisect.bisect_left(vertices, source_coords)
 
-        part_path_direct = cross_section.vertices[split_idx:]
-        source_ground_height = interpolate_edge(cross_section.vertices[split_idx - 1], cross_section.vertices[split_idx], source_coords)
-        part_path_direct = [(source_coords[0], source_coords[1], source_ground_height)] + part_path_direct
+        source_ground_height = interpolate_edge(vertices[split_idx - 1], vertices[split_idx], source_coords)
 
         cross_section_collinear_point = CrossSection([source_coords], receiver, source_point, 0)
-        cross_section_collinear_point.vertices = part_path_direct
+        cross_section_collinear_point.vertex_array = np.vstack((
+            (source_coords[0], source_coords[1], source_ground_height),
+            cross_section.vertex_array[split_idx:]
+            ))
         source_length = source_point.left_length + source_point.right_length
         cross_section_collinear_point.extension = {
             0: ["source", source_height, source_length],
-            len(cross_section_collinear_point.vertices) - 1 : ["receiver", receiver_height]
+            len(cross_section_collinear_point.vertex_array) - 1 : ["receiver", receiver_height]
         }
-        part_path_direct_material = [cross_section.materials[split_idx]] + cross_section.materials[split_idx:]
-        cross_section_collinear_point.materials = part_path_direct_material
+        cross_section_collinear_point.material_codes = np.concatenate((
+            cross_section.material_codes[split_idx:split_idx + 1],
+            cross_section.material_codes[split_idx:]
+            ))
         
         # Key must already exist, so no need to check.
         self.cross_sections[receiver].append(cross_section_collinear_point)
@@ -92,19 +142,28 @@ class CrossSectionManager:
         #
         for receiver_coords, receiver in receiver_points.items():  
             #print(i, receiver.receiver_coords)
+            if len(receiver.source_points) == 0:
+                continue
+
+            # get the receiver triangle. If this triangle is in a building, than it is not valid and should not be included.
+            # This is done here, since there is no need for the collinear paths to be checked in this case. 
+            receiver_triangle = self.get_receiver_triangle(receiver_coords, tin)
+            if receiver_triangle is None:
+                continue
+
+            # walk the tin from the receiver to the furthest source point of all rays at once
+            furthest_source_points = [source_points[-1] for source_points in receiver.source_points.values()]
+            ray_crossings = tin.walk_segments(
+                np.full(len(furthest_source_points), receiver_triangle),
+                np.tile(receiver_coords, (len(furthest_source_points), 1)),
+                np.array([source_point.source_coords for source_point in furthest_source_points])
+                )
+
             #For each ray, grab all the source points between the receiver and the ray_end
-            for ray_end, source_points in receiver.source_points.items():
+            for source_points, crossings in zip(receiver.source_points.values(), ray_crossings):
                 #Create cross section for the furthest away point
                 furthest_source_point = source_points[-1]
-
-                # find the receiver triangle. If this triangle is in a building, than it is not valid and should not be included.
-                # This is done here, since there is no need for the collinear paths to be checked in this case. 
-                init_tr = tin.find_vts_near_pt(receiver_coords)
-                receiver_triangle = tin.find_receiver_triangle(init_tr, receiver_coords)
-                if(tin.attributes[receiver_triangle][0] == 'b'):
-                    continue
-                self.receiver_triangles[receiver_coords] = receiver_triangle
-                cross_section = self.get_cross_section(receiver_coords, furthest_source_point, [furthest_source_point.source_coords], tin, ground_type_manager, building_manager, source_height, receiver_height)
+                cross_section = self.get_cross_section(receiver_coords, furthest_source_point, [furthest_source_point.source_coords], tin, ground_type_manager, building_manager, source_height, receiver_height, crossings=crossings)
 
                 # create cross sections for intermediate source points, if available
                 for source_point in source_points[:-1]:
@@ -116,6 +175,17 @@ class CrossSectionManager:
                         receiver_coords
                         )
 
+    def get_memory(self):
+        """
+        Explanation: The memory used by all cross sections, see CrossSection.get_memory
+        ---------------
+        Input: void
+        ---------------
+        Output:
+            integer - bytes
+        """
+        return sum(cross_section.get_memory() for cross_sections in self.cross_sections.values() for cross_section in cross_sections)
+
     def get_cross_sections_reflection(self, reflection_path, tin, ground_type_manager, building_manager, source_height, receiver_height):
 
         # can work with single and multi order reflection.
@@ -128,23 +198,28 @@ class CrossSectionManager:
 
             self.get_cross_section(reflection_path.receiver, reflection_path.source, path, tin, ground_type_manager, building_manager, source_height, receiver_height, reflection_heights)
     
-    def write_obj(self, output_path, individual_bool): 
+    def write_obj(self, output_path, individual_bool, append=False, receiver_offset=0, vertex_offset=0): 
         """
         Explanation: Write the paths of this receiver to an obj file, calls write_cross_section_to_obj
         ---------------
         Input:
             individual_bool : boolean - defines whether the paths shoudl be written per receiver, or all combined.
+            append : boolean - add the paths to the combined obj file, instead of overwriting it (when writing in chunks)
+            receiver_offset : integer - the number of the first receiver, for the names of the files per receiver
+            vertex_offset : integer - the number of vertices already in the combined obj file
         ---------------
         Output:
-            void (writes obj file)
+            integer - the receiver_offset for the next chunk
+            integer - the vertex_offset for the next chunk
         """
         print("=== Writing {} ===".format("paths_section"))
         # write the paths to individual receiver files.
         if(individual_bool):
-            i = 0
+            i = receiver_offset
             for receiver, cross_sections in self.cross_sections.items():
                 self.write_cross_section_to_obj("{}/receiver_{}.obj".format(output_path, i), cross_sections)
                 i +=1
+            return i, vertex_offset
 
         # Or write one file with all paths
         else:
@@ -153,15 +228,14 @@ class CrossSectionManager:
                 total_paths.append(cross_sections)
 
             cross_section_file_path = output_path + "/cross_sections.obj"
-            with open(cross_section_file_path, 'w') as f_out:
+            with open(cross_section_file_path, 'a' if append else 'w') as f_out:
                 base = 0
-                vts_count_lst = [0]
-                counter = 0
+                vts_count_lst = [vertex_offset]
+                counter = vertex_offset
                 for cross_section_paths in total_paths:
                     #write the vertices
                     for cross_section in cross_section_paths:
-                        path = cross_section.vertices
-                        path = np.array(path)
+                        path = cross_section.vertex_array
                         counter = counter + len(path)
                         vts_count_lst.append(counter)
                         for v in path:
@@ -171,13 +245,14 @@ class CrossSectionManager:
                 j = 0
                 for cross_section_paths in total_paths:
                     for i, cross_section in enumerate(cross_section_paths):
-                        path = cross_section.vertices
+                        path = cross_section.vertex_array
                         base = vts_count_lst[j]
                         f_out.write("l")
                         for i in range(len(path)):
                             f_out.write(" " + str(base + i + 1))
                         f_out.write("\n")
                         j += 1
+            return receiver_offset + len(total_paths), counter
 
     def write_cross_section_to_obj(self, filename, cross_sections):
 
@@ -187,8 +262,7 @@ class CrossSectionManager:
             vts_count_lst = [0]
             counter = 0
             for cross_section in cross_sections:
-                path = cross_section.vertices
-                path = np.array(path)
+                path = cross_section.vertex_array
                 counter = counter + len(path)
                 vts_count_lst.append(counter)
                 for v in path:
@@ -196,7 +270,7 @@ class CrossSectionManager:
             
             #print(vts_count_lst)
             for i, cross_section in enumerate(cross_sections):
-                path = cross_section.vertices
+                path = cross_section.vertex_array
                 base = vts_count_lst[i]
                 f_out.write("l")
                 for i in range(len(path)):
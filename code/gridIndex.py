@@ -0,0 +1,103 @@
+import math
+import numpy as np
+
+
+class GridIndex:
+
+    def __init__(self, bounding_boxes, cell_size=None):
+        """
+        A uniform grid over a set of bounding boxes [x_min, y_min, x_max, y_max], stored as flat arrays:
+        the ids of the boxes in each cell are items[cell_start[cell]:cell_start[cell + 1]].
+        When no cell size is given, it is chosen so there are about as many cells as boxes.
+        """
+        self.bounding_boxes = np.asarray(bounding_boxes, dtype=float).reshape(-1, 4)
+        box_count = len(self.bounding_boxes)
+
+        if box_count == 0:
+            self.origin = np.zeros(2)
+            extent = np.zeros(2)
+        else:
+            self.origin = self.bounding_boxes[:, :2].min(axis=0)
+            extent = self.bounding_boxes[:, 2:].max(axis=0) - self.origin
+
+        if cell_size is None:
+            # about one box per cell, but not smaller than the average box
+            box_size = np.mean(self.bounding_boxes[:, 2:] - self.bounding_boxes[:, :2]) if box_count > 0 else 0.0
+            cell_size = max(math.sqrt(extent[0] * extent[1] / max(box_count, 1)), box_size, 1.0)
+        self.cell_size = float(cell_size)
+        self.columns = int(extent[0] // self.cell_size) + 1
+        self.rows = int(extent[1] // self.cell_size) + 1
+
+        # the range of cells every box covers
+        first_cells = self.get_cells(self.bounding_boxes[:, :2])
+        last_cells = self.get_cells(self.bounding_boxes[:, 2:])
+        cell_columns = last_cells[:, 0] - first_cells[:, 0] + 1
+        cell_rows = last_cells[:, 1] - first_cells[:, 1] + 1
+        cell_counts = cell_columns * cell_rows
+
+        # expand to (box, cell) pairs
+        box_ids = np.repeat(np.arange(box_count), cell_counts)
+        pair_start = np.repeat(np.cumsum(cell_counts) - cell_counts, cell_counts)
+        position = np.arange(len(box_ids)) - pair_start
+        pair_columns = np.repeat(cell_columns, cell_counts)
+        column = np.repeat(first_cells[:, 0], cell_counts) + position % np.maximum(pair_columns, 1)
+        row = np.repeat(first_cells[:, 1], cell_counts) + position // np.maximum(pair_columns, 1)
+        cell_ids = row * self.columns + column
+
+        order = np.argsort(cell_ids, kind='stable')
+        self.items = box_ids[order]
+        self.cell_start = np.searchsorted(cell_ids[order], np.arange(self.rows * self.columns + 1))
+
+    def get_cells(self, pts):
+        """
+        Explanation: Find the (column, row) of the cells of points, points outside the grid get the closest cell.
+        ---------------
+        Input:
+            pts : (n, 2) array - the points
+        ---------------
+        Output:
+            (n, 2) integer array - the column and row of each point
+        """
+        cells = np.floor((np.asarray(pts, dtype=float).reshape(-1, 2) - self.origin) / self.cell_size).astype(np.int64)
+        cells[:, 0] = np.clip(cells[:, 0], 0, self.columns - 1)
+        cells[:, 1] = np.clip(cells[:, 1], 0, self.rows - 1)
+        return cells
+
+    def query(self, bounding_box):
+        """
+        Explanation: Find all boxes that overlap with a bounding box.
+        ---------------
+        Input:
+            bounding_box : [x_min, y_min, x_max, y_max] - the box to search in
+        ---------------
+        Output:
+            numpy array - the (sorted) ids of the overlapping boxes
+        """
+        if len(self.bounding_boxes) == 0:
+            return np.zeros(0, dtype=np.int64)
+        (first_column, first_row), (last_column, last_row) = self.get_cells([bounding_box[:2], bounding_box[2:]])
+
+        # the cells of one row are consecutive in the items
+        candidates = [
+            self.items[self.cell_start[row * self.columns + first_column]:self.cell_start[row * self.columns + last_column + 1]]
+            for row in range(first_row, last_row + 1)
+        ]
+        candidates = np.unique(np.concatenate(candidates))
+
+        boxes = self.bounding_boxes[candidates]
+        overlaps = ((boxes[:, 0] <= bounding_box[2]) & (boxes[:, 2] >= bounding_box[0]) &
+                    (boxes[:, 1] <= bounding_box[3]) & (boxes[:, 3] >= bounding_box[1]))
+        return candidates[overlaps]
+
+    def query_radius(self, pt, radius):
+        """
+        Explanation: Find all boxes that overlap with the bounding box of a circle.
+        ---------------
+        Input:
+            pt : [x, y] - the centre of the circle
+            radius : float - the radius of the circle
+        ---------------
+        Output:
+            numpy array - the (sorted) ids of the boxes
+        """
+        return self.query([pt[0] - radius, pt[1] - radius, pt[0] + radius, pt[1] + radius])
@@ -9,19 +9,139 @@ from shapely.ops import transform
 from scipy.spatial import KDTree
 from time import time
 
+# Layout of the binary tin (.tinb) header, all sections follow it in a fixed order, each aligned to 64 bytes.
+BINARY_TIN_MAGIC = b"TINB"
+BINARY_TIN_VERSION = 1
+BINARY_TIN_ALIGNMENT = 64
+BINARY_TIN_HEADER = np.dtype([
+    ("magic", "S4"),
+    ("version", "<u4"),
+    ("vertex_count", "<u8"),
+    ("triangle_count", "<u8"),
+    ("attribute_name_count", "<u8"),
+    ("attribute_name_length", "<u8"),
+    ("has_locator", "<u8"),
+    ("bounding_box_3d", "<f8", (6,))
+])
 
 class GroundTin:
 
-    def __init__(self, vts, trs, attr = []):
-        self.vts = np.array(vts)
-        self.trs = np.array(trs)
-        self.attributes = np.array(attr)
+    def __init__(self, vts, trs, attr = [], vts_to_tr = None, attribute_names = None):
+        # asarray, so memory mapped arrays (see read_from_binary) are not copied
+        self.vts = np.asarray(vts)
+        self.trs = np.asarray(trs)
+
+        # attributes are stored as an integer code per triangle, the code is an index in the side tables.
+        # attr can either be the attribute strings, or the codes when the attribute_names are given
+        if attribute_names is None:
+            attr, attribute_names = encode_attributes(attr)
+        self.attributes = np.asarray(attr)
+        self.attribute_names = np.asarray(attribute_names)
+        self.attribute_materials = []
+        self.attribute_in_building = None
+        self.build_attribute_tables()
+        self.building_triangles = self.find_building_triangles()
         
         self.kd_vts = KDTree(self.vts[:, [0, 1]])
+        if vts_to_tr is None:
+            vts_to_tr = self.build_vertex_triangle_index()
+        self.vts_to_tr = vts_to_tr
 
         self.bounding_box_2d = [100000000, 100000000, -100000000, -100000000]
         self.bounding_box_3d = [100000000, 100000000, 100000000, -100000000, -100000000, -100000000]
 
+        # optional walking tables, see build_edge_equations
+        self.triangle_vertices = None
+        self.edge_equations = None
+        self.edge_origin = None
+
+    def build_edge_equations(self, origin=None):
+        """
+        Explanation: Precompute per triangle the coordinates of its three vertices and the line equations of its three
+        edges, both stored contiguously per triangle, so the walking routines read one row instead of indexing the vertices
+        through the triangles. The edge equations are a * x + b * y + c, equal to the side test of the edge with (x, y),
+        the coordinates are relative to the origin to keep the constants small.
+        Takes 144 bytes per triangle, use edge_equations_memory to check it before enabling it on a big tin.
+        ---------------
+        Input:
+            origin : (x, y) - optional, the local origin of the edge equations, by default the minimum of the vertices
+        ---------------
+        Output:
+            integer - the memory used by the tables in bytes
+        """
+        if origin is None:
+            origin = self.vts[:, :2].min(axis=0) if len(self.vts) > 0 else (0.0, 0.0)
+        # python floats, so the scalar walking routines do not mix in numpy scalars
+        self.edge_origin = (float(origin[0]), float(origin[1]))
+        self.triangle_vertices = np.ascontiguousarray(self.vts[self.trs[:, :3]], dtype=float)
+
+        # edge i goes from vertex i to vertex i + 1, side_test(p, q, pt) = (py - qy) * x + (qx - px) * y + (px * qy - qx * py)
+        starts = self.triangle_vertices[:, :, :2] - self.edge_origin
+        ends = np.roll(starts, -1, axis=1)
+        self.edge_equations = np.empty((len(self.trs), 3, 3))
+        self.edge_equations[:, :, 0] = starts[:, :, 1] - ends[:, :, 1]
+        self.edge_equations[:, :, 1] = ends[:, :, 0] - starts[:, :, 0]
+        self.edge_equations[:, :, 2] = starts[:, :, 0] * ends[:, :, 1] - ends[:, :, 0] * starts[:, :, 1]
+        return self.edge_equations_memory()
+
+    def edge_equations_memory(self):
+        """
+        Explanation: The memory used by the tables of build_edge_equations
+        ---------------
+        Input: void
+        ---------------
+        Output:
+            integer - bytes used, 0 when the tables are not built
+        """
+        if self.edge_equations is None:
+            return 0
+        return self.triangle_vertices.nbytes + self.edge_equations.nbytes
+
+    def get_triangle_vertices(self, trs):
+        """
+        Explanation: Get the vertex coordinates of one or more triangles, from the precomputed table if it is built
+        ---------------
+        Input:
+            trs : integer or (n,) array - triangle ID(s)
+        ---------------
+        Output:
+            (3, 3) or (n, 3, 3) array - the coordinates of the vertices of the triangle(s)
+        """
+        if self.triangle_vertices is not None:
+            return self.triangle_vertices[trs]
+        return self.vts[self.trs[trs][..., :3]]
+
+    def edge_sides(self, pts, trs):
+        """
+        Explanation: The side tests of the three edges of each triangle with its point, with the precomputed edge equations
+        ---------------
+        Input:
+            pts : (n, 2+) array - the points
+            trs : (n,) array - triangle ID per point
+        ---------------
+        Output:
+            (n, 3) array - the side test per edge, positive when the point is on the inside of the edge
+        """
+        pts = np.asarray(pts, dtype=float)[:, :2] - np.array(self.edge_origin)
+        equations = self.edge_equations[trs]
+        return equations[:, :, 0] * pts[:, np.newaxis, 0] + equations[:, :, 1] * pts[:, np.newaxis, 1] + equations[:, :, 2]
+
+    def edge_side(self, pt, tr):
+        """
+        Explanation: Scalar version of edge_sides, the side tests of the three edges of one triangle with the point.
+        The row of the triangle is read once and the tests are done with python floats.
+        ---------------
+        Input:
+            pt : [x,y(,z)] - the point
+            tr : integer - triangle ID
+        ---------------
+        Output:
+            list - the side test per edge, positive when the point is on the inside of the edge
+        """
+        x = pt[0] - self.edge_origin[0]
+        y = pt[1] - self.edge_origin[1]
+        return [a * x + b * y + c for a, b, c in self.edge_equations[tr].tolist()]
+
     def point_in_triangle(self, pt, tr):
         """
         Explanation: Do a side test for all edges with the pt, if they are all positive.
@@ -34,6 +154,10 @@ class GroundTin:
             Boolean - True if the point is inside the triangle.
         """
         e = 10 ** (-4)
+        if self.edge_equations is not None:
+            d1, d2, d3 = self.edge_side(pt, tr)
+            return d1 >= -e and d2 >= -e and d3 >= -e
+
         d1 = misc.side_test(self.vts[self.trs[tr][0]], self.vts[self.trs[tr][1]], pt)
         d2 = misc.side_test(self.vts[self.trs[tr][1]], self.vts[self.trs[tr][2]], pt)
         d3 = misc.side_test(self.vts[self.trs[tr][2]], self.vts[self.trs[tr][0]], pt)
@@ -43,12 +167,180 @@ class GroundTin:
         else:
             return False
 
+    def points_in_triangles(self, pts, trs):
+        """
+        Explanation: Batch version of point_in_triangle, do a side test for all edges of each triangle with its point.
+        Use point_in_triangle for a single point, it avoids the overhead of the numpy arrays.
+        ---------------
+        Input:
+        pts : (n, 2+) array - The points to check.
+        trs : (n,) array - triangle ID per point.
+        ---------------
+        Output:
+            (n,) boolean array - True if the point is inside its triangle.
+        """
+        e = 10 ** (-4)
+        pts = np.asarray(pts, dtype=float)
+        if self.edge_equations is not None:
+            return np.all(self.edge_sides(pts, trs) >= -e, axis=1)
+
+        tr_vts = self.vts[self.trs[trs][:, :3]]
+
+        # side_test works on the transposed arrays, so it is computed for all points at once
+        d1 = misc.side_test(tr_vts[:, 0].T, tr_vts[:, 1].T, pts.T)
+        d2 = misc.side_test(tr_vts[:, 1].T, tr_vts[:, 2].T, pts.T)
+        d3 = misc.side_test(tr_vts[:, 2].T, tr_vts[:, 0].T, pts.T)
+
+        return (d1 >= -e) & (d2 >= -e) & (d3 >= -e)
+
+    def build_attribute_tables(self):
+        """
+        Explanation: Build the side tables of the attribute codes; the (material, building id) of every code and whether
+        the code is a building.
+        ---------------
+        Input: void
+        ---------------
+        Output: void (fills self.attribute_materials and self.attribute_in_building)
+        """
+        self.attribute_materials = []
+        self.attribute_in_building = np.zeros(len(self.attribute_names), dtype=bool)
+        for code, attribute in enumerate(self.attribute_names):
+            if attribute[0] == 'b':
+                self.attribute_materials.append(("A0", str(attribute)))
+                self.attribute_in_building[code] = True
+            elif attribute[1:2] == "0":
+                self.attribute_materials.append(("G", -1))
+            else:
+                self.attribute_materials.append(("C", -1))
+
+    def find_building_triangles(self):
+        """
+        Explanation: Find the first triangle of every building, used as a starting point to walk to a building.
+        ---------------
+        Input: void
+        ---------------
+        Output:
+            dictionary - building id: triangle id
+        """
+        building_triangles = {}
+        # np.unique gives the first triangle for each code that is used
+        used_codes, first_triangles = np.unique(self.attributes, return_index=True)
+        for code, tr in zip(used_codes, first_triangles):
+            if self.attribute_in_building[code]:
+                building_triangles[str(self.attribute_names[code])] = int(tr)
+        return building_triangles
+
+    def get_material(self, tr):
+        """
+        Explanation: Returns the material and building id of the triangle
+        ---------------
+        Input:
+            tr : integer - id of triangle
+        ---------------
+        Output:
+            string - material type ("A0", "G" or "C")
+            string / integer - id of the building, or -1 if it is ground
+        """
+        return self.attribute_materials[self.attributes[tr]]
+
+    def in_building(self, tr):
+        """
+        Explanation: Check if a triangle is part of a building
+        ---------------
+        Input:
+            tr : integer - id of triangle
+        ---------------
+        Output:
+            Boolean - True if the triangle is part of a building.
+        """
+        return self.attribute_in_building[self.attributes[tr]]
+
+    def build_vertex_triangle_index(self):
+        """
+        Explanation: For every vertex store the id of the first triangle that uses it, so a starting triangle
+        for a walk can be found in constant time. Vertices that are not used by any triangle point to triangle 0.
+        ---------------
+        Input: void
+        ---------------
+        Output:
+            numpy array - for each vertex id, the id of an incident triangle.
+        """
+        vts_to_tr = np.zeros(len(self.vts), dtype=np.int64)
+        if len(self.trs) == 0:
+            return vts_to_tr
+
+        # the triangle vertex ids flattened, np.unique returns the first position where every vertex occurs
+        used_vts, first_position = np.unique(self.trs[:, :3].ravel(), return_index=True)
+        vts_to_tr[used_vts] = first_position // 3
+        return vts_to_tr
+
     def find_vts_near_pt(self, p_receiver):
-        nearest_vts = self.kd_vts.query(p_receiver)[1]
-        for i, tr in enumerate(self.trs):
-            if nearest_vts in tr[:3]:
-                return i
-        return 2
+        """
+        Explanation: Find a triangle close to the point, one that is incident to the nearest vertex.
+        ---------------
+        Input:
+            p_receiver : [x,y(,z)] - The point to look for.
+        ---------------
+        Output:
+            integer - triangle id of a triangle that uses the nearest vertex.
+        """
+        nearest_vts = self.kd_vts.query(p_receiver[:2])[1]
+        return self.vts_to_tr[nearest_vts]
+
+    def find_vts_near_pts(self, pts):
+        """
+        Explanation: Batch version of find_vts_near_pt, find a triangle close to each point.
+        ---------------
+        Input:
+            pts : (n, 2+) array - The points to look for.
+        ---------------
+        Output:
+            (n,) integer array - per point the id of a triangle that uses the nearest vertex.
+        """
+        pts = np.asarray(pts, dtype=float)
+        if len(pts) == 0:
+            return np.zeros(0, dtype=np.int64)
+        nearest_vts = self.kd_vts.query(pts[:, :2])[1]
+        return np.asarray(self.vts_to_tr[nearest_vts], dtype=np.int64)
+
+    def find_receiver_triangles(self, trs_init, pts):
+        """
+        Explanation: Batch version of find_receiver_triangle, walks from the initial triangles to the triangles of all points
+        at once, every walk takes the same steps as find_receiver_triangle.
+        ---------------
+        Input:
+            trs_init : (n,) integer array - per point an (arbitrary) triangle id to start from.
+            pts : (n, 2+) array - the points.
+        ---------------
+        Output:
+            (n,) integer array - per point the id of the triangle underneath it
+        """
+        nbs = np.array([5, 3, 4]) # -> [v0, v1, v2, n0, n1, n2]
+        trs = np.array(trs_init, dtype=np.int64)
+        pts = np.asarray(pts, dtype=float)
+        active = np.arange(len(trs))
+        if len(active) == 0:
+            return trs
+        for i in range(1000):  # max 1000 triangles to walk.
+            current = trs[active]
+            # do the side test for all sides of all triangles
+            if self.edge_equations is not None:
+                d = self.edge_sides(pts[active], current)
+            else:
+                tr_vts = self.vts[self.trs[current][:, :3]]
+                d = np.stack([
+                    misc.side_test(tr_vts[:, j].T, tr_vts[:, (j + 1) % 3].T, pts[active].T) for j in range(3)
+                    ], axis=1)
+
+            # the points for which all side_tests are positive are found, the others go to the neighbour of the minimum
+            walking = ~np.all(d >= 0, axis=1)
+            active = active[walking]
+            if len(active) == 0:
+                return trs
+            neighbours = self.trs[current[walking]]
+            trs[active] = neighbours[np.arange(len(active)), nbs[np.argmin(d[walking], axis=1)]]
+        print("no tr found after 1000 loops")
+        assert(False)
 
     def find_receiver_triangle(self, tr_init, p_receiver):
         """
@@ -65,9 +357,12 @@ class GroundTin:
         tr = tr_init
         for i in range(1000):  # max 1000 triangles to walk.
             # do the side test for all sides, returns the value
-            d1 = misc.side_test(self.vts[self.trs[tr][0]], self.vts[self.trs[tr][1]], p_receiver)
-            d2 = misc.side_test(self.vts[self.trs[tr][1]], self.vts[self.trs[tr][2]], p_receiver)
-            d3 = misc.side_test(self.vts[self.trs[tr][2]], self.vts[self.trs[tr][0]], p_receiver)
+            if self.edge_equations is not None:
+                d1, d2, d3 = self.edge_side(p_receiver, tr)
+            else:
+                d1 = misc.side_test(self.vts[self.trs[tr][0]], self.vts[self.trs[tr][1]], p_receiver)
+                d2 = misc.side_test(self.vts[self.trs[tr][1]], self.vts[self.trs[tr][2]], p_receiver)
+                d3 = misc.side_test(self.vts[self.trs[tr][2]], self.vts[self.trs[tr][0]], p_receiver)
 
             # If all side_tests are positive (point is either exactly on the edge, or on the inside)
             if d1 >= 0 and d2 >= 0 and d3 >= 0:
@@ -87,6 +382,64 @@ class GroundTin:
         print("no tr found after 1000 loops")
         assert(False)
 
+    def walk_segments(self, start_triangles, origins, destinations):
+        """
+        Explanation: Batch version of the walk of CrossSection.get_cross_section, walks from the start triangles along the
+        segments from the origins to the destinations, all segments are advanced one triangle at a time together. The
+        outgoing edge and the crossing point are found like CrossSection.get_next_edge and intersection_point.
+        ---------------
+        Input:
+            start_triangles : (n,) integer array - the triangle each walk starts in (that contains its origin)
+            origins : (n, 2+) array - the points the walks start at
+            destinations : (n, 2+) array - the points the walks go to
+        ---------------
+        Output:
+            list - per segment a list of crossings (crossing point (x, y, z), triangle before, triangle after),
+            in the order they are crossed.
+        """
+        nbs = np.array([5, 3, 4]) # -> [v0, v1, v2, n0, n1, n2]
+        current = np.array(start_triangles, dtype=np.int64)
+        origins = np.asarray(origins, dtype=float)[:, :2]
+        destinations = np.asarray(destinations, dtype=float)[:, :2]
+        crossings = [[] for _ in range(len(current))]
+        if len(current) == 0:
+            return crossings
+
+        active = np.nonzero(~self.points_in_triangles(destinations, current))[0]
+        while len(active) > 0:
+            # Make sure that we have not gotten of the TIN
+            assert np.all(current[active] != -1)
+            triangles = current[active]
+            tr_vts = self.get_triangle_vertices(triangles)
+            origin = origins[active].T
+            destination = destinations[active].T
+
+            # the outgoing edge goes from the right (or on the line) to the left of the walking direction, first match
+            sides = np.stack([misc.side_test(origin, destination, tr_vts[:, i].T) for i in range(3)], axis=1)
+            outgoing = (sides <= 0) & (np.roll(sides, -1, axis=1) > 0)
+            if not np.all(outgoing.any(axis=1)):
+                print("something went wrong here")
+                assert(False)
+            edge_ids = np.argmax(outgoing, axis=1)
+            rows = np.arange(len(active))
+            vertex_right = tr_vts[rows, edge_ids]
+            vertex_left = tr_vts[rows, (edge_ids + 1) % 3]
+
+            # the crossing point, see intersection_point
+            area_right = np.abs(misc.side_test(origin, destination, vertex_right.T))
+            area_left = np.abs(misc.side_test(origin, destination, vertex_left.T))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                part_right = np.where((area_left + area_right) < 0.1, 0.5, area_right / (area_left + area_right))
+            points = vertex_right + (vertex_left - vertex_right) * part_right[:, np.newaxis]
+
+            next_triangles = self.trs[triangles][rows, nbs[edge_ids]]
+            for segment, point, triangle, next_triangle in zip(active.tolist(), points, triangles.tolist(), next_triangles.tolist()):
+                crossings[segment].append((point, triangle, next_triangle))
+
+            current[active] = next_triangles
+            active = active[~self.points_in_triangles(destinations[active], next_triangles)]
+        return crossings
+
     def intersection_point(self, edge, source, receiver):
         """
         Explanation:
@@ -131,9 +484,40 @@ class GroundTin:
         Output:
         interpolated value
         """
-        v1 = self.vts[self.trs[tr][0]]
-        v2 = self.vts[self.trs[tr][1]]
-        v3 = self.vts[self.trs[tr][2]]
+        if self.triangle_vertices is not None:
+            v1, v2, v3 = self.triangle_vertices[tr].tolist()
+        else:
+            v1 = self.vts[self.trs[tr][0]]
+            v2 = self.vts[self.trs[tr][1]]
+            v3 = self.vts[self.trs[tr][2]]
+
+        w1 = ((v2[1] - v3[1]) * (pt[0] - v3[0]) + (v3[0] - v2[0]) * (pt[1] - v3[1])) / (
+                (v2[1] - v3[1]) * (v1[0] - v3[0]) + (v3[0] - v2[0]) * (v1[1] - v3[1]))
+        w2 = ((v3[1] - v1[1]) * (pt[0] - v3[0]) + (v1[0] - v3[0]) * (pt[1] - v3[1])) / (
+                (v2[1] - v3[1]) * (v1[0] - v3[0]) + (v3[0] - v2[0]) * (v1[1] - v3[1]))
+        w3 = 1 - w1 - w2
+
+        return w1 * v1[2] + w2 * v2[2] + w3 * v3[2]
+
+    def interpolate_triangles(self, trs, pts):
+        """
+        Explanation:
+        Batch version of interpolate_triangle, find the interpolated height of each point in its triangle.
+        Use interpolate_triangle for a single point, it avoids the overhead of the numpy arrays.
+        ---------------
+        Input:
+        trs: (n,) array - id of the triangle per point
+        pts: (n, 2+) array - points inside their triangle
+        ---------------
+        Output:
+        (n,) array - interpolated values
+        """
+        pts = np.asarray(pts, dtype=float)
+        tr_vts = self.vts[self.trs[trs][:, :3]]
+        v1 = tr_vts[:, 0].T
+        v2 = tr_vts[:, 1].T
+        v3 = tr_vts[:, 2].T
+        pt = pts.T
 
         w1 = ((v2[1] - v3[1]) * (pt[0] - v3[0]) + (v3[0] - v2[0]) * (pt[1] - v3[1])) / (
                 (v2[1] - v3[1]) * (v1[0] - v3[0]) + (v3[0] - v2[0]) * (v1[1] - v3[1]))
@@ -170,43 +554,167 @@ class GroundTin:
 
     def write_to_obj(self, file_path):
         """
-        Explination: Writes out the tin to an obj file.
+        Explination: Writes out the tin to an obj file, if the file ends with .gz it is compressed.
         ---------------
         Input:
             file_path : string - The path to the obj file we want to write to.
         ---------------
         Output: void
         """
-        with open(file_path, 'w+') as output_file:
-            for vertex in self.vts:
-                vertex_str = "v " + str(vertex[0]) + " " + str(vertex[1]) + " " + str(vertex[2]) + "\n"
-                output_file.write(vertex_str)
-
-            for triangle in self.trs:
-                triangle_str = "f " + str(triangle[0] + 1) + " " + str(triangle[1] + 1) + " " + str(
-                    triangle[2] + 1) + "\n"
-                output_file.write(triangle_str)
+        with misc.open_text_file(file_path, 'w') as output_file:
+            misc.write_rows(output_file, "v %r %r %r\n", np.asarray(self.vts, dtype=float))
+            misc.write_rows(output_file, "f %d %d %d\n", np.asarray(self.trs)[:, :3] + 1)
 
     def write_to_objp(self, file_path):
         """
-        Explination: Writes out the tin to an objp file.
+        Explination: Writes out the tin to an objp file, if the file ends with .gz it is compressed.
         ---------------
         Input:
             file_path : string - The path to the obj file we want to write to.
         ---------------
         Output: void
         """
+        with misc.open_text_file(file_path, 'w') as output_file:
+            misc.write_rows(output_file, "v %r %r %r\n", np.asarray(self.vts, dtype=float))
+            misc.write_rows(output_file, "f %d %d %d %d %d %d\n", np.asarray(self.trs) + 1)
+            misc.write_rows(output_file, "a %s\n", self.attribute_names[np.asarray(self.attributes)])
+
+    def write_to_binary(self, file_path):
+        """
+        Explination: Writes out the tin to a binary tin (tinb) file, including the vertex to triangle index.
+        ---------------
+        Input:
+            file_path : string - The path to the tinb file we want to write to.
+        ---------------
+        Output: void
+        """
+        write_binary(file_path, self.vts, self.trs, self.attributes, self.attribute_names, self.vts_to_tr)
+
+def encode_attributes(attributes):
+    """
+    Explination: Turn the attribute strings of the triangles into integer codes and a table with the unique strings.
+    ---------------
+    Input:
+        attributes : list / numpy array - the attribute string per triangle ('b<part_id>' / 'g<index>').
+    ---------------
+    Output:
+        numpy array - int32 code per triangle, index into the attribute names.
+        numpy array - the unique attribute names.
+    """
+    if len(attributes) == 0:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=str)
+    attribute_names, attribute_codes = np.unique(np.asarray(attributes, dtype=str), return_inverse=True)
+    return attribute_codes.astype(np.int32), attribute_names
+
+def get_binary_offsets(header):
+    """
+    Explination: Compute the byte offset of every section in a binary tin file.
+    ---------------
+    Input:
+        header : numpy record - the header of the file (BINARY_TIN_HEADER)
+    ---------------
+    Output:
+        dictionary - section name: (offset, dtype, shape)
+    """
+    vertex_count = int(header["vertex_count"])
+    triangle_count = int(header["triangle_count"])
+    name_length = max(int(header["attribute_name_length"]), 1)
+    sections = [
+        ("vts", np.dtype("<f8"), (vertex_count, 3)),
+        ("trs", np.dtype("<i4"), (triangle_count, 6)),
+        ("attribute_codes", np.dtype("<i4"), (triangle_count,)),
+        ("attribute_names", np.dtype("S{}".format(name_length)), (int(header["attribute_name_count"]),))
+    ]
+    if header["has_locator"]:
+        sections.append(("vts_to_tr", np.dtype("<i4"), (vertex_count,)))
+
+    offsets = {}
+    offset = BINARY_TIN_HEADER.itemsize
+    for name, dtype, shape in sections:
+        # align every section, so the memory maps start at a nice boundary
+        offset += -offset % BINARY_TIN_ALIGNMENT
+        offsets[name] = (offset, dtype, shape)
+        offset += dtype.itemsize * int(np.prod(shape))
+    offsets["end"] = (offset, None, None)
+    return offsets
+
+def write_binary(file_path, vts, trs, attribute_codes, attribute_names, vts_to_tr=None):
+    """
+    Explination: Write a tin to a binary tin (tinb) file, which can be memory mapped by read_from_binary.
+    ---------------
+    Input:
+        file_path : string - The path to the tinb file.
+        vts : (n, 3) array - the vertices.
+        trs : (m, 6) array - the triangles with their neighbours [v1, v2, v3, n0, n1, n2].
+        attribute_codes : (m,) array - integer code per triangle, index into attribute_names.
+        attribute_names : (k,) array - the attribute strings.
+        vts_to_tr : (n,) array - optional, an incident triangle per vertex.
+    ---------------
+    Output: void
+    """
+    vts = np.asarray(vts, dtype="<f8").reshape(-1, 3)
+    trs = np.asarray(trs, dtype="<i4").reshape(-1, 6)
+    attribute_names = np.char.encode(np.asarray(attribute_names, dtype=str), "utf-8")
+
+    header = np.zeros((), dtype=BINARY_TIN_HEADER)
+    header["magic"] = BINARY_TIN_MAGIC
+    header["version"] = BINARY_TIN_VERSION
+    header["vertex_count"] = len(vts)
+    header["triangle_count"] = len(trs)
+    header["attribute_name_count"] = len(attribute_names)
+    header["attribute_name_length"] = attribute_names.dtype.itemsize
+    header["has_locator"] = vts_to_tr is not None
+    if len(vts) > 0:
+        header["bounding_box_3d"] = np.concatenate((vts.min(axis=0), vts.max(axis=0)))
+
+    sections = {
+        "vts": vts,
+        "trs": trs,
+        "attribute_codes": np.asarray(attribute_codes),
+        "attribute_names": attribute_names,
+        "vts_to_tr": vts_to_tr
+    }
+    offsets = get_binary_offsets(header)
+    with open(file_path, 'wb') as output_file:
+        output_file.write(header.tobytes())
+        for name, (offset, dtype, shape) in offsets.items():
+            if name == "end":
+                continue
+            output_file.write(b"\0" * (offset - output_file.tell()))
+            output_file.write(np.ascontiguousarray(sections[name], dtype=dtype).tobytes())
+
+def read_from_binary(file_path):
+    """
+    Explination: Open a binary tin (tinb) file and make a tin from it. The arrays are memory mapped, so opening is fast
+    and processes opening the same file share the memory.
+    ---------------
+    Input:
+        file_path : string - The path to the tinb file.
+    ---------------
+    Output:
+        ground_tin : GroundTin - The tin that was created from the binary file.
+    """
+    header = np.fromfile(file_path, dtype=BINARY_TIN_HEADER, count=1)[0]
+    if header["magic"] != BINARY_TIN_MAGIC or header["version"] != BINARY_TIN_VERSION:
+        raise ValueError("{} is not a binary tin file (version {})".format(file_path, BINARY_TIN_VERSION))
+
+    arrays = {}
+    for name, (offset, dtype, shape) in get_binary_offsets(header).items():
+        if name == "end":
+            continue
+        if int(np.prod(shape)) == 0:
+            arrays[name] = np.zeros(shape, dtype=dtype)
+        else:
+            arrays[name] = np.memmap(file_path, dtype=dtype, mode='r', offset=offset, shape=shape)
 
-        with open(file_path, 'w+') as output_file:
-            for vertex in self.vts:
-                vertex_str = "v " + str(vertex[0]) + " " + str(vertex[1]) + " " + str(vertex[2]) + "\n"
-                output_file.write(vertex_str)
+    attribute_names = np.char.decode(np.asarray(arrays["attribute_names"]), "utf-8")
 
-            for triangle in self.trs:
-                triangle_str = "f " + str(triangle[0] + 1) + " " + str(triangle[1] + 1) + " " + str(
-                    triangle[2] + 1) + " " + str(triangle[3] + 1) + " " + str(triangle[4] + 1) + " " + str(
-                    triangle[5] + 1) + "\n"
-                output_file.write(triangle_str)
+    ground_tin = GroundTin(arrays["vts"], arrays["trs"], arrays["attribute_codes"], arrays.get("vts_to_tr"), attribute_names)
+    bounding_box_3d = [float(value) for value in header["bounding_box_3d"]]
+    ground_tin.bounding_box_2d = [bounding_box_3d[0], bounding_box_3d[1], bounding_box_3d[3], bounding_box_3d[4]]
+    ground_tin.bounding_box_3d = bounding_box_3d
+
+    return ground_tin
 
 def read_from_objp(file_path):
     """
@@ -229,8 +737,8 @@ def read_from_objp(file_path):
     total_list_create_time = 0
     total_class_create_time = 0
 
-    # Read the file and store all the vertices and triangles
-    with open(file_path, 'r') as input_file:
+    # Read the file and store all the vertices and triangles, the file can be compressed with gzip (.gz)
+    with misc.open_text_file(file_path, 'r') as input_file:
 
         lines = input_file.readlines()
 
@@ -1,9 +1,9 @@
+import create_objp
 import fiona
 import groundTin as TIN
 import misc
 import numpy as np
 import sys
-import xml.etree.cElementTree as ET
 
 from buildingManager import BuildingManager
 from crossSectionManager import CrossSectionManager
@@ -12,53 +12,26 @@ from receiverManager import ReceiverManager
 from receiverPoint import ReceiverPoint
 from reflectionManager import ReflectionManager
 from reflectionPath import ReflectionPath
+from roadNetwork import read_road_network
+from tiledTin import TiledTin
 from xmlParserManager import XmlParserManager
 
 from pathlib import Path
 from shapely.geometry import Polygon, LineString, Point
-from shapely.strtree import STRtree
 from time import time
 
 def return_segments_source(path):
     """
-    Explanation: Changes the data structure of the coordinates from strings to floats in tuples
+    Explanation: Reads the road lines of a GML file (gml:coordinates or gml:posList) or a GeoPackage into a RoadNetwork,
+    every pair of consecutive coordinates is a segment
     ---------------
     Input:
-    path : string - the path of the XML file
+    path : string - the path of the GML or GeoPackage file
     ---------------
     Output:
-    list : list - a list of all the coordinates are saved as (x, y), line segments with every next point in list
+    RoadNetwork - all road line segments, the road id of a segment is the number of the line it is part of
     """
-    count = 0
-    sets = []
-    line_string = []
-    line_float = []
-    line_segments = []
-
-    tree = ET.parse(path)
-    root = tree.getroot()
-    for child in root.iter():
-        if "coordinates" in child.tag:
-            coordinates = child.text
-            line_string = coordinates.split()
-            if len(line_string) > 1:
-                for point in line_string:
-                    coord = point.split(',')
-                    sets.append((float(coord[0]), float(coord[1])))
-                    count += 1
-                if len(line_string) == count:
-                    line_float.append(sets)
-                    count = 0
-                    sets = []
-    for elem in line_float:
-        if len(elem) == 2:
-            line_segments.append(LineString((elem[0], elem[1])))
-        if len(elem) > 2:
-            for i in range(len(elem) - 1):
-                first_el = elem[i]
-                next_el = elem[i + 1]
-                line_segments.append(LineString((first_el, next_el)))
-    return line_segments
+    return read_road_network(path)
 
 def read_building_and_ground(file_path, building_manager, ground_type_manager):
     
@@ -85,6 +58,60 @@ def read_building_and_ground(file_path, building_manager, ground_type_manager):
                         roof_level = record['properties']['h_dak']
                         building_manager.add_building(part_id, bag_id, geometry, ground_level, roof_level)
 
+def stream_receivers(receiver_manager, chunk_size, road_network, tin, ground_type_manager, building_manager,
+        source_finding_strategy, adaptive_level_tolerance, reflection_order, source_height, receiver_height,
+        minimal_building_height_threshold, default_noise_levels, output_folders, write_obj_paths_per_receiver):
+    """
+    Explanation: Runs all steps (sources, direct cross sections, reflections, reflected cross sections, obj and xml) for
+    one chunk of receivers at a time, and writes the output of the chunk before starting the next one. The sources,
+    reflection paths and cross sections of a chunk are dropped after it is written, so the memory use depends on the
+    chunk size and not on the number of receivers. The receivers and obj vertices are numbered on over the chunks.
+    ---------------
+    Input:
+        receiver_manager : ReceiverManager - all receiver points
+        chunk_size : integer - the number of receivers per chunk
+        road_network : RoadNetwork - all road line segments
+        tin, ground_type_manager, building_manager - the ground and buildings, see main
+        source_finding_strategy, adaptive_level_tolerance - see ReceiverManager.determine_source_points
+        reflection_order : integer - 1 or 2, see ReflectionManager.get_reflection_paths
+        source_height, receiver_height, minimal_building_height_threshold, default_noise_levels - see main
+        output_folders : (string, string) - the output folder and the xml folder
+        write_obj_paths_per_receiver : boolean - see CrossSectionManager.write_obj
+    ---------------
+    Output: void (writes the obj, xml files and receiver_dict)
+    """
+    xml_manager = XmlParserManager()
+    receiver_offset = 0
+    obj_receiver_offset = 0
+    obj_vertex_offset = 0
+
+    for chunk_id, receiver_points in enumerate(receiver_manager.get_receiver_chunks(chunk_size)):
+        watch = time()
+        receiver_manager.determine_source_points(road_network, source_finding_strategy, adaptive_level_tolerance, receiver_points)
+
+        cross_section_manager = CrossSectionManager(source_height, receiver_height)
+        cross_section_manager.locate_receivers(receiver_points, tin)
+        cross_section_manager.get_cross_sections_direct(receiver_points, tin, ground_type_manager, building_manager, source_height, receiver_height)
+
+        reflection_manager = ReflectionManager()
+        reflection_manager.get_reflection_paths(receiver_points, building_manager, tin, minimal_building_height_threshold, reflection_order)
+        for receiver_coords, ray_paths in reflection_manager.reflection_paths.items():
+            for ray_end, source_paths in ray_paths.items():
+                for source, reflection_path in source_paths.items():
+                    cross_section_manager.get_cross_sections_reflection(reflection_path, tin, ground_type_manager, building_manager, source_height, receiver_height)
+
+        # the first chunk creates the output files, the others append to them
+        obj_receiver_offset, obj_vertex_offset = cross_section_manager.write_obj(output_folders[0], write_obj_paths_per_receiver,
+            chunk_id > 0, obj_receiver_offset, obj_vertex_offset)
+        receiver_offset = xml_manager.write_xml_files(cross_section_manager, default_noise_levels, output_folders,
+            receiver_offset, chunk_id > 0, False)
+
+        # the sources are not needed anymore after the chunk is written
+        for receiver in receiver_points.values():
+            receiver.source_points = {}
+
+        print("chunk {} with {} receivers in {:.2f} seconds".format(chunk_id, len(receiver_points), time() - watch))
+
 def main(sys_args):
     start = time()
     print("Running {}".format(sys_args[0]))
@@ -104,9 +131,35 @@ def main(sys_args):
     output_folder_xml = output_folder + "/xml"
     Path(output_folder_xml).mkdir(parents=True, exist_ok=True)
 
-    tin = TIN.read_from_objp(constraint_tin_file_path)
+    # Memory the loaded tiles of a tiled tin may use, before the least recently used tiles are dropped
+    tile_cache_budget = 2 * 1024 ** 3 # bytes
+
+    # Converted cityjson tins are stored here, by default next to the cityjson file
+    if len(sys_args) > 6:
+        tin_cache_folder = sys_args[6]
+    else:
+        tin_cache_folder = str(Path(constraint_tin_file_path).parent / "tin_cache")
+
+    # The tin can be read from a text objp file, a (much faster to open) binary tinb file,
+    # a folder with a tiled tin (see tiledTin.py) of which the tiles are loaded when they are needed,
+    # or directly from the cityjson file (the converted tin is cached in the tin_cache_folder)
+    if Path(constraint_tin_file_path).is_dir():
+        tin = TiledTin(constraint_tin_file_path, tile_cache_budget)
+    elif constraint_tin_file_path.endswith(".tinb"):
+        tin = TIN.read_from_binary(constraint_tin_file_path)
+    elif constraint_tin_file_path.endswith(".json"):
+        tin = create_objp.read_from_cityjson(constraint_tin_file_path, tin_cache_folder)
+    else:
+        tin = TIN.read_from_objp(constraint_tin_file_path)
 
     print("read dtm in {:.2f} seconds".format(time() - start))
+
+    # Precompute the vertices and edge equations of every triangle for the walking routines (144 bytes per triangle),
+    # turn this off for a tin that does not fit in memory twice. Not available for a tiled tin.
+    precompute_edge_equations = True
+    if precompute_edge_equations and not isinstance(tin, TiledTin):
+        edge_equations_memory = tin.build_edge_equations()
+        print("precomputed edge equations using {:.1f} MB".format(edge_equations_memory / 1024 ** 2))
     watch = time()
 
     ground_type_manager = GroundTypeManager()
@@ -120,20 +173,15 @@ def main(sys_args):
     
     receiver_manager = ReceiverManager()
     receiver_manager.read_receiver_points(receiver_point_file_path)
+    if isinstance(tin, TiledTin):
+        # process the receivers tile by tile, so only the tiles around the current receivers are needed
+        receiver_manager.sort_receiver_points(tin.tile_size)
 
-    road_lines = [] #COS: Find a better place for this?
-    road_lines = return_segments_source(road_lines_file_path) #Read in the roads
-    tree_roads = STRtree(road_lines) # create a tree for roads
+    road_network = return_segments_source(road_lines_file_path) #Read in the roads
 
     print("read receiver points in: {:.2f}\nFind sources for each receiver...".format(time() - watch))
     watch = time()
 
-    #Get the source points for each receiver
-    receiver_manager.determine_source_points(tree_roads)   
-    
-    print("found sources in {:.2f} seconds \nGet direct cross sections...".format(time() - watch))
-    watch = time()
-
     # set variables to play with
     source_height = 0.05
     receiver_height = 2.0
@@ -145,17 +193,51 @@ def main(sys_args):
         "power"              : np.array([78.2, 74.1, 71.6, 74.2, 78, 73.8, 69, 55.9])
     }
 
+    # Process the receivers in chunks, running all steps for a chunk and writing its output before the next chunk,
+    # so the memory use does not grow with the number of receivers. Otherwise each step is run for all receivers at once.
+    streaming = False
+    receiver_chunk_size = 100
+
+    #Get the source points for each receiver
+    # "per_ray" intersects every ray separately with shapely, "vectorized" intersects all rays of a receiver at once,
+    # "angular_span" only intersects each road with the rays within the angle at which it is seen (fewer pairs than
+    # "vectorized" for short roads, but all pairs in the worst case),
+    # "adaptive" uses fewer rays where the roads are far away or do not change, giving fewer paths (and xml files),
+    # rays are refined where the free field level of neighbouring rays differs more than the tolerance (dB)
+    source_finding_strategy = "angular_span"
+    adaptive_level_tolerance = 1.0
+
+    # Get first order reflections, and second order reflections when the reflection order is 2
+    reflection_order = 1
+
+    #Optionally write an obj with all the cross sections
+    write_obj_paths_per_receiver = False
+
+    if streaming:
+        stream_receivers(receiver_manager, receiver_chunk_size, road_network, tin, ground_type_manager, building_manager,
+            source_finding_strategy, adaptive_level_tolerance, reflection_order, source_height, receiver_height,
+            minimal_building_height_threshold, default_noise_levels, (output_folder, output_folder_xml), write_obj_paths_per_receiver)
+        print("total runtime in: {}".format(time() - start))
+        return
+
+    receiver_manager.determine_source_points(road_network, source_finding_strategy, adaptive_level_tolerance)
+    
+    print("found sources in {:.2f} seconds \nGet direct cross sections...".format(time() - watch))
+    watch = time()
+
     #Create the cross sections for all the direct paths
     cross_section_manager = CrossSectionManager(source_height, receiver_height)
+    # find the triangles of all receivers once, receivers in buildings are marked as not valid
+    cross_section_manager.locate_receivers(receiver_manager.receiver_points, tin)
     #print("=== get direct cross sections ===")
     cross_section_manager.get_cross_sections_direct(receiver_manager.receiver_points, tin, ground_type_manager, building_manager, source_height, receiver_height)
     
     print("ran direct cross_sections in: {:.2f} seconds\nGet reflected paths...".format(time() - watch))
     watch = time()
 
-    # Get first order reflections   
+    #Get the reflection paths
     reflection_manager = ReflectionManager()
-    reflection_manager.get_reflection_paths(receiver_manager.receiver_points, building_manager, tin, minimal_building_height_threshold)
+    reflection_manager.get_reflection_paths(receiver_manager.receiver_points, building_manager, tin, minimal_building_height_threshold, reflection_order)
     
     print("ran reflected paths in: {:.2f} seconds\nGet reflected cross sections...".format(time() - watch))
     watch = time()
@@ -166,11 +248,10 @@ def main(sys_args):
             for source, reflection_path in source_paths.items():
                 cross_section_manager.get_cross_sections_reflection(reflection_path, tin, ground_type_manager, building_manager, source_height, receiver_height)
 
-    print("ran reflected cross sections in: {:.2f}".format(time() - watch))
+    print("ran reflected cross sections in: {:.2f}, the cross sections use {:.1f} MB".format(time() - watch, cross_section_manager.get_memory() / 1024 ** 2))
     watch = time()
 
     #Optionally write an obj with all the cross sections
-    write_obj_paths_per_receiver = False
     cross_section_manager.write_obj(output_folder, write_obj_paths_per_receiver)
    
     print("wrote cross sections in: {:.2f} seconds\nWrite xml files...".format(time() - watch))
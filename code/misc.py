@@ -1,4 +1,5 @@
 
+import gzip
 import math
 import numpy as np
 import xml.etree.cElementTree as ET
@@ -68,7 +69,8 @@ def line_intersect(line1, line2):
     line2: the line segment of the source
     ---------------
     Output:
-    point : it returns the point where both line segments intersect
+    point : it returns the point where both line segments intersect, False when they do not intersect or are parallel
+    (also when they are collinear and overlap, there is no single intersection point)
     """
     d = (line2[1][1] - line2[0][1]) * (line1[1][0] - line1[0][0]) - (line2[1][0] - line2[0][0]) * (
                 line1[1][1] - line1[0][1])
@@ -85,6 +87,66 @@ def line_intersect(line1, line2):
     y = line1[0][1] + uA * (line1[1][1] - line1[0][1])
     return (x, y)
 
+def batch_line_intersect(line1_start, line1_end, line2_start, line2_end):
+    """
+    Explanation: Batch version of line_intersect, intersects many pairs of line segments at once. The inputs are
+    broadcast against each other, so for example (n, 1, 2) and (1, m, 2) arrays test all n x m pairs.
+    ---------------
+    Input:
+    line1_start, line1_end : [..., 2] arrays - the first points and last points of the first line segments
+    line2_start, line2_end : [..., 2] arrays - the first points and last points of the second line segments
+    ---------------
+    Output:
+    points : [..., 2] array - the intersection points (only meaningful where intersects is True)
+    intersects : [...] boolean array - True where the line segments intersect
+    u_a : [...] array - the position of the intersection along the first line segments (0 at the start, 1 at the end)
+
+    Parallel pairs (d == 0), including collinear segments that overlap, do not intersect, on purpose the same as
+    line_intersect. An overlap has no single intersection point; for the rays a road along the ray is found by the
+    neighbouring rays, and a wall in line with the receiver gives no reflection.
+    """
+    line1_start = np.asarray(line1_start, dtype=float)
+    line1_end = np.asarray(line1_end, dtype=float)
+    line2_start = np.asarray(line2_start, dtype=float)
+    line2_end = np.asarray(line2_end, dtype=float)
+    dx1 = line1_end[..., 0] - line1_start[..., 0]
+    dy1 = line1_end[..., 1] - line1_start[..., 1]
+    dx2 = line2_end[..., 0] - line2_start[..., 0]
+    dy2 = line2_end[..., 1] - line2_start[..., 1]
+    dx12 = line1_start[..., 0] - line2_start[..., 0]
+    dy12 = line1_start[..., 1] - line2_start[..., 1]
+
+    d = dy2 * dx1 - dx2 * dy1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        u_a = (dx2 * dy12 - dy2 * dx12) / d
+        u_b = (dx1 * dy12 - dy1 * dx12) / d
+    intersects = (d != 0) & (u_a >= 0) & (u_a <= 1) & (u_b >= 0) & (u_b <= 1)
+
+    points = np.stack((line1_start[..., 0] + u_a * dx1, line1_start[..., 1] + u_a * dy1), axis=-1)
+    return points, intersects, u_a
+
+def batch_x_line_intersect(line1_start, line1_end, line2_start, line2_end):
+    """
+    Explanation: Batch version of x_line_intersect, the (virtual) intersection points of many pairs of lines.
+    The inputs are broadcast against each other.
+    ---------------
+    Input:
+    line1_start, line1_end : [..., 2] arrays - two points on each of the first lines
+    line2_start, line2_end : [..., 2] arrays - two points on each of the second lines
+    ---------------
+    Output:
+    points : [..., 2] array - the intersection points.
+    """
+    x1, y1 = line1_start[..., 0], line1_start[..., 1]
+    x2, y2 = line1_end[..., 0], line1_end[..., 1]
+    x3, y3 = line2_start[..., 0], line2_start[..., 1]
+    x4, y4 = line2_end[..., 0], line2_end[..., 1]
+    num_x = (x1 * y2 - y1 * x2) * (x3 - x4) - (x1 - x2) * (x3 * y4 - y3 * x4)
+    num_y = (x1 * y2 - y1 * x2) * (y3 - y4) - (y1 - y2) * (x3 * y4 - y3 * x4)
+    denom = (x1 - x2) * (y3 - y4) - (y1 - y2) * (x3 - x4)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.stack((num_x / denom, num_y / denom), axis=-1)
+
 def x_line_intersect(line1, line2):
     """
     Explanation: A function that returns the intersection point between two xlines. It doesn't matter if the line segments
@@ -138,6 +200,24 @@ def get_rotated_point(p1, p2, angle):
 
     return new_vector
 
+def batch_rotated_points(p1, p2, angle):
+    """
+    Explanation: Batch version of get_rotated_point, rotates many points p2 around p1.
+    ---------------
+    Input:
+    p1 : [..., 2] array - The centres of rotation.
+    p2 : [..., 2] array - The points to be rotated.
+    angle : float / [...] array - The angle of rotation (in radians), positive is counterclockwise
+    ---------------
+    Output:
+    [..., 2] array - The rotated points (at the squared distance from p1, like get_rotated_point)
+    """
+    vector = np.asarray(p2, dtype=float) - np.asarray(p1, dtype=float)
+    vector_length = vector[..., 0] ** 2 + vector[..., 1] ** 2
+    vector_angle = np.arctan2(vector[..., 1], vector[..., 0]) + angle
+    new_vector = np.stack((vector_length * np.cos(vector_angle), vector_length * np.sin(vector_angle)), axis=-1)
+    return new_vector + p1
+
 def side_test(pa, pb, pc):
         """
         Explanation:
@@ -202,6 +282,42 @@ def reverse_bisect_left(a, x, lo=0, hi=None):
         else: hi = mid
     return lo
 
+def open_text_file(file_path, mode='r'):
+    """
+    Explanation: Open a text file, files ending with .gz are (de)compressed with gzip.
+    ---------------
+    Input:
+    file_path : string - the path of the file
+    mode : string - 'r' to read, 'w' to write
+    ---------------
+    Output:
+    file object
+    """
+    if str(file_path).endswith(".gz"):
+        return gzip.open(file_path, mode + 't')
+    return open(file_path, mode)
+
+def write_rows(output_file, row_format, rows, block_size=65536):
+    """
+    Explanation: Write all rows of an array with the same format, a whole block of rows is formatted at once
+    instead of one string per row. %r formats floats exactly like str().
+    ---------------
+    Input:
+    output_file : file object - the (text) file to write to
+    row_format : string - format of one row, with one % field per column (e.g. "v %r %r %r\n")
+    rows : (n, columns) array / list - the values to write
+    block_size : integer - the number of rows that is formatted at once
+    ---------------
+    Output:
+    void
+    """
+    rows = np.asarray(rows)
+    if rows.ndim == 1:
+        rows = rows.reshape(-1, 1)
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        output_file.write((row_format * len(block)) % tuple(block.ravel().tolist()))
+
 def write_default_noise(filename, Lw, source_height):
     """
         CURRENTLY NOT USED
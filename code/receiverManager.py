@@ -1,6 +1,7 @@
 import fiona
+import math
 
-from receiverPoint import ReceiverPoint
+from receiverPoint import ADAPTIVE_LEVEL_TOLERANCE, ReceiverPoint
 
 class ReceiverManager:
 
@@ -16,8 +17,73 @@ class ReceiverManager:
                 rec_pt = ReceiverPoint(rec_pt_coords)
                 self.receiver_points[rec_pt_coords] = rec_pt
 
-    def determine_source_points(self, source_lines):
+    def sort_receiver_points(self, cell_size):
+        """
+        Explanation: Reorder the receiver points so that receivers in the same square cell are processed together,
+        the cells are ordered row by row.
+        ---------------
+        Input:
+            cell_size : float - the size of the cells
+        ---------------
+        Output: void (reorders self.receiver_points)
+        """
+        def cell_key(rec_pt_coords):
+            column = math.floor(rec_pt_coords[0] / cell_size)
+            row = math.floor(rec_pt_coords[1] / cell_size)
+            return (row, column)
+
+        sorted_coords = sorted(self.receiver_points.keys(), key=cell_key)
+        self.receiver_points = {rec_pt_coords: self.receiver_points[rec_pt_coords] for rec_pt_coords in sorted_coords}
+
+    def get_receiver_chunks(self, chunk_size):
+        """
+        Explanation: Split the receiver points in chunks, in their current order, to process them chunk by chunk
+        ---------------
+        Input:
+            chunk_size : integer - the number of receivers per chunk
+        ---------------
+        Output:
+            generator - a dictionary (receiver coordinates: ReceiverPoint) per chunk
+        """
+        chunk = {}
+        for rec_pt_coords, rec_pt in self.receiver_points.items():
+            chunk[rec_pt_coords] = rec_pt
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = {}
+        if len(chunk) > 0:
+            yield chunk
+
+    def determine_source_points(self, road_network, strategy="per_ray", level_tolerance=ADAPTIVE_LEVEL_TOLERANCE, receiver_points=None):
+        """
+        Explanation: Find the source points of every receiver
+        ---------------
+        Input:
+            road_network : RoadNetwork - all road line segments
+            strategy : string - how the rays are intersected with the roads;
+                "per_ray" queries and intersects the roads for every ray with shapely,
+                "vectorized" queries the roads once per receiver and intersects all rays at once with numpy,
+                "angular_span" queries the roads once per receiver and only intersects each road with the rays within its angle
+                (fewer pairs than "vectorized" for short roads, the same in the worst case),
+                "adaptive" starts with coarse rays and only refines them where the roads or their distance change
+            level_tolerance : float - only for "adaptive", the level difference (dB) between neighbouring rays above which they are refined
+            receiver_points : dictionary - optional, only find the sources of these receiver points (a chunk), by default all
+        ---------------
+        Output: void (fills the source_points of the receiver points)
+        """
+        if receiver_points is None:
+            receiver_points = self.receiver_points
+
         #Go through all the receiver points and get their possible source points
-        for rec_pt_coords in self.receiver_points.keys():
-            rec_pt = self.receiver_points[rec_pt_coords]
-            rec_pt.find_intersection_points(source_lines)
\ No newline at end of file
+        for rec_pt_coords in receiver_points.keys():
+            rec_pt = receiver_points[rec_pt_coords]
+            if strategy == "vectorized":
+                rec_pt.find_intersection_points_vectorized(road_network)
+            elif strategy == "angular_span":
+                rec_pt.find_intersection_points_spans(road_network)
+            elif strategy == "adaptive":
+                rec_pt.find_intersection_points_adaptive(road_network, level_tolerance)
+            elif strategy == "per_ray":
+                rec_pt.find_intersection_points(road_network.get_strtree())
+            else:
+                raise ValueError("unknown source finding strategy: {}".format(strategy))
\ No newline at end of file
@@ -2,7 +2,7 @@ import fiona
 import math
 import numpy as np
 import xml.etree.cElementTree as ET
-from misc import get_rotated_point, x_line_intersect
+from misc import batch_line_intersect, batch_x_line_intersect, get_rotated_point, x_line_intersect
 
 from sourcePoint import SourcePoint
 
@@ -11,6 +11,12 @@ from shapely.geometry import Polygon, LineString, Point
 CNOSSOS_RADIUS = 2000.0
 CNOSSOS_ANGLE = 2.0
 
+# Adaptive source finding: the first rays are ADAPTIVE_COARSE_FACTOR times the step angle apart, and are refined
+# (down to the step angle) where the neighbouring rays hit other roads, or where the free field level of the
+# sources on them differs more than ADAPTIVE_LEVEL_TOLERANCE dB.
+ADAPTIVE_COARSE_FACTOR = 8
+ADAPTIVE_LEVEL_TOLERANCE = 1.0
+
 class ReceiverPoint:
 
     def __init__(self, receiver_coords, radius = CNOSSOS_RADIUS, step_angle = CNOSSOS_ANGLE):
@@ -93,3 +99,246 @@ class ReceiverPoint:
                                             (point.source_coords[0] - self.receiver_coords[0]) ** 2 + (point.source_coords[1] - self.receiver_coords[1]) ** 2) ** 0.5)
 
                 self.source_points[following] = sorted_list_intersection
+
+    def get_road_segments(self, road_network):
+        """
+        Explanation: Get the road line segments within the radius of the receiver
+        ---------------
+        Input:
+        road_network : RoadNetwork - all road line segments
+        ---------------
+        Output:
+        (n,) array - the ids of the road segments in the road network
+        (n, 2, 2) array - the start and end point of each road segment
+        """
+        segment_ids = road_network.query_radius(self.receiver_coords, self.radius)
+        return segment_ids, road_network.segments[segment_ids]
+
+    def add_source_points(self, angles, ray_ends, segment_ids, segments, ray_ids, road_ids, left_angles=None, right_angles=None):
+        """
+        Explanation: Intersect pairs of rays and road segments, and store the intersections as source points.
+        Every source point represents the part of the road between the (virtual) rays half a step angle to its left
+        and right, or, when they are given, between the rays left_angles to the left and right_angles to the right.
+        ---------------
+        Input:
+        angles : (n,) array - the angle of every ray
+        ray_ends : list - the end point of every ray, on the circle around the receiver
+        segment_ids : (m,) array - the ids of the road segments in the road network
+        segments : (m, 2, 2) array - the road segments
+        ray_ids : (k,) array - the ray of every pair to test
+        road_ids : (k,) array - the road segment of every pair to test
+        left_angles : (n,) array - the angle (radians) to the left every ray represents (default: half the step angle)
+        right_angles : (n,) array - the angle (radians) to the right every ray represents (default: half the step angle)
+        ---------------
+        Output:
+        void (fills self.source_points, a list of source points per ray, sorted on distance to the receiver)
+        """
+        receiver = np.array(self.receiver_coords[:2], dtype=float)
+        points, intersects, distance = batch_line_intersect(
+            receiver, np.array(ray_ends)[ray_ids], segments[road_ids, 0], segments[road_ids, 1])
+        ray_ids = ray_ids[intersects]
+        road_ids = road_ids[intersects]
+        points = points[intersects]
+        distance = distance[intersects]
+        if len(ray_ids) == 0:
+            return
+
+        # find the virtual intersection of the rays half an angle to the left and right with the same road
+        half_angle = math.radians(self.step_angle) / 2.0
+        ray_angles = angles[ray_ids]
+        left_angle = half_angle if left_angles is None else left_angles[ray_ids]
+        right_angle = half_angle if right_angles is None else right_angles[ray_ids]
+        left_ends = receiver + self.radius * np.stack((np.cos(ray_angles + left_angle), np.sin(ray_angles + left_angle)), axis=-1)
+        right_ends = receiver + self.radius * np.stack((np.cos(ray_angles - right_angle), np.sin(ray_angles - right_angle)), axis=-1)
+        point_left = batch_x_line_intersect(receiver, left_ends, segments[road_ids, 0], segments[road_ids, 1])
+        point_right = batch_x_line_intersect(receiver, right_ends, segments[road_ids, 0], segments[road_ids, 1])
+        if left_angles is None:
+            left_lengths = right_lengths = np.hypot(*(point_left - point_right).T) / 2
+        else:
+            # the angles differ, so does the length of road on both sides
+            left_lengths = np.hypot(*(point_left - points).T)
+            right_lengths = np.hypot(*(points - point_right).T)
+
+        # sort on ray, and on distance to the receiver within the ray
+        order = np.lexsort((road_ids, distance, ray_ids))
+        for i in order:
+            source_pt = SourcePoint(tuple(points[i].tolist()))
+            source_pt.left_length = left_lengths[i]
+            source_pt.right_length = right_lengths[i]
+            source_pt.segment_id = segment_ids[road_ids[i]]
+            following = ray_ends[ray_ids[i]]
+            if following not in self.source_points:
+                self.source_points[following] = []
+            self.source_points[following].append(source_pt)
+
+    def get_angular_spans(self, segments):
+        """
+        Explanation: Find the angles at which road segments are seen from the receiver
+        ---------------
+        Input:
+        segments : (m, 2, 2) array - the road segments
+        ---------------
+        Output:
+        (m,) array - the angle (radians, 0 to 2 pi) where the span of each segment starts
+        (m,) array - the (counter clockwise) width of the span of each segment, at most pi
+        """
+        # the angle of both end points of the roads, and the angular span the road covers (at most half a circle)
+        vectors = segments - np.array(self.receiver_coords[:2], dtype=float)
+        end_angles = np.arctan2(vectors[:, :, 1], vectors[:, :, 0]) % (2.0 * math.pi)
+        span = (end_angles[:, 1] - end_angles[:, 0] + math.pi) % (2.0 * math.pi) - math.pi
+        span_start = np.where(span >= 0, end_angles[:, 0], end_angles[:, 1])
+        span_width = np.abs(span)
+        return span_start, span_width
+
+    def find_intersection_points_vectorized(self, road_network):
+        """
+        Explanation: Vectorized version of find_intersection_points, the roads within the radius are queried once,
+        and all rays are intersected with all these roads at once.
+        ---------------
+        Input:
+        road_network : RoadNetwork - all road line segments
+        ---------------
+        Output:
+        void (fills self.source_points, a list of source points per ray, sorted on distance to the receiver)
+        """
+        segment_ids, segments = self.get_road_segments(road_network)
+        angles = np.arange(0, (2.0 * math.pi), math.radians(self.step_angle))
+        ray_ends = [self.return_points_circle(angle) for angle in angles]
+
+        # test all rays with all roads
+        ray_ids, road_ids = np.divmod(np.arange(len(angles) * len(segments)), len(segments))
+        self.add_source_points(angles, ray_ends, segment_ids, segments, ray_ids, road_ids)
+
+    def find_intersection_points_spans(self, road_network):
+        """
+        Explanation: Angular span version of find_intersection_points. The roads within the radius are queried once,
+        and every road is only intersected with the rays within the angle at which it is seen from the receiver.
+        The number of tests is the number of (ray, road) pairs of which the angles overlap,
+        instead of all pairs as in find_intersection_points_vectorized. That is much less for short roads, but the same
+        in the worst case (roads all around the receiver).
+        ---------------
+        Input:
+        road_network : RoadNetwork - all road line segments
+        ---------------
+        Output:
+        void (fills self.source_points, a list of source points per ray, sorted on distance to the receiver)
+        """
+        segment_ids, segments = self.get_road_segments(road_network)
+        step_angle_radians = math.radians(self.step_angle)
+        angles = np.arange(0, (2.0 * math.pi), step_angle_radians)
+        ray_ends = [self.return_points_circle(angle) for angle in angles]
+        ray_count = len(angles)
+        if len(segments) == 0:
+            return
+
+        span_start, span_width = self.get_angular_spans(segments)
+
+        # the first and last ray within the span, one extra ray on both sides to be safe with rounding,
+        # the exact intersection test removes the rays that do not hit the road.
+        first_ray = np.floor(span_start / step_angle_radians).astype(np.int64) - 1
+        last_ray = np.ceil((span_start + span_width) / step_angle_radians).astype(np.int64) + 1
+        ray_counts = np.minimum(last_ray - first_ray + 1, ray_count)
+        # the receiver is on (the line of) the road, all rays can hit it
+        on_road = span_width >= math.pi - 1e-9
+        first_ray[on_road] = 0
+        ray_counts[on_road] = ray_count
+
+        # expand to (ray, road) pairs, all rays of the span of each road
+        road_ids = np.repeat(np.arange(len(segments)), ray_counts)
+        pair_start = np.repeat(np.cumsum(ray_counts) - ray_counts, ray_counts)
+        ray_ids = (np.repeat(first_ray, ray_counts) + np.arange(len(road_ids)) - pair_start) % ray_count
+
+        self.add_source_points(angles, ray_ends, segment_ids, segments, ray_ids, road_ids)
+
+    def find_intersection_points_adaptive(self, road_network, level_tolerance=ADAPTIVE_LEVEL_TOLERANCE,
+                                          coarse_factor=ADAPTIVE_COARSE_FACTOR):
+        """
+        Explanation: Adaptive version of find_intersection_points. It starts with rays coarse_factor times the step
+        angle apart (and one ray on every road that would be hit by the fine rays, so no road is missed), and adds
+        the ray in between two neighbouring rays when they hit other roads, or when the free field level (10 log(1 / d^2))
+        of the sources on them differs more than level_tolerance dB. Rays are never closer than the step angle.
+        Every ray represents the angle halfway to its neighbouring rays, so the lengths of the source points
+        together still cover the roads.
+        ---------------
+        Input:
+        road_network : RoadNetwork - all road line segments
+        level_tolerance : float - the level difference (dB) between neighbouring rays above which they are refined
+        coarse_factor : integer - the number of step angles between the first rays
+        ---------------
+        Output:
+        void (fills self.source_points, a list of source points per ray, sorted on distance to the receiver)
+        """
+        segment_ids, segments = self.get_road_segments(road_network)
+        step_angle_radians = math.radians(self.step_angle)
+        angles = np.arange(0, (2.0 * math.pi), step_angle_radians)
+        ray_ends = [self.return_points_circle(angle) for angle in angles]
+        ray_count = len(angles)
+        if len(segments) == 0:
+            return
+        road_numbers = road_network.road_ids[segment_ids]
+        span_start, span_width = self.get_angular_spans(segments)
+        # the receiver is on (the line of) the road, all rays can hit it
+        span_width[span_width >= math.pi - 1e-9] = 2.0 * math.pi
+        receiver = np.array(self.receiver_coords[:2], dtype=float)
+        ray_end_array = np.array(ray_ends)
+
+        # the coarse rays, and the first fine ray within the span of each road segment
+        first_rays = np.ceil(span_start / step_angle_radians).astype(np.int64) % ray_count
+        in_span = (angles[first_rays] - span_start) % (2.0 * math.pi) <= span_width
+        new_rays = np.union1d(np.arange(0, ray_count, max(int(coarse_factor), 1)), first_rays[in_span])
+
+        # per ray the (sorted) roads it hits, and the distance to each of them
+        ray_roads = {}
+        ray_distances = {}
+        rays = np.zeros(0, dtype=np.int64)
+        while len(new_rays) > 0:
+            # intersect the new rays with the road segments they can hit (with a margin of one ray)
+            margin = step_angle_radians
+            in_span = (angles[new_rays][:, np.newaxis] - span_start + margin) % (2.0 * math.pi) <= span_width + 2 * margin
+            pair_rays, pair_roads = np.nonzero(in_span)
+            pair_rays = new_rays[pair_rays]
+            _, intersects, distance = batch_line_intersect(
+                receiver, ray_end_array[pair_rays], segments[pair_roads, 0], segments[pair_roads, 1])
+            for ray in new_rays:
+                ray_roads[ray] = ()
+                ray_distances[ray] = np.zeros(0)
+            order = np.lexsort((distance, road_numbers[pair_roads], pair_rays))
+            order = order[intersects[order]]
+            for ray in np.unique(pair_rays[order]):
+                selection = order[pair_rays[order] == ray]
+                ray_roads[ray] = tuple(road_numbers[pair_roads[selection]].tolist())
+                ray_distances[ray] = distance[selection] * self.radius
+            rays = np.union1d(rays, new_rays)
+
+            # find the neighbouring rays (the last one neighbours the first one) that have to be refined
+            next_rays = np.roll(rays, -1)
+            next_rays[-1] += ray_count
+            new_rays = []
+            for ray, next_ray in zip(rays, next_rays):
+                if next_ray - ray < 2:
+                    continue
+                next_ray_id = next_ray % ray_count
+                if ray_roads[ray] != ray_roads[next_ray_id]:
+                    refine = True
+                else:
+                    with np.errstate(divide='ignore'):
+                        level_difference = 20.0 * np.abs(np.log10(ray_distances[ray] / ray_distances[next_ray_id]))
+                    refine = np.any(level_difference > level_tolerance)
+                if refine:
+                    new_rays.append(((ray + next_ray) // 2) % ray_count)
+            new_rays = np.array(new_rays, dtype=np.int64)
+
+        # every ray represents the angles halfway to its neighbours
+        next_rays = np.roll(rays, -1)
+        next_rays[-1] += ray_count
+        previous_rays = np.roll(rays, 1)
+        previous_rays[0] -= ray_count
+        left_angles = np.zeros(ray_count)
+        right_angles = np.zeros(ray_count)
+        left_angles[rays] = (next_rays - rays) * step_angle_radians / 2.0
+        right_angles[rays] = (rays - previous_rays) * step_angle_radians / 2.0
+
+        # intersect the final rays with the roads within their span
+        in_span = (angles[rays][:, np.newaxis] - span_start + step_angle_radians) % (2.0 * math.pi) <= span_width + 2 * step_angle_radians
+        ray_ids, road_ids = np.nonzero(in_span)
+        self.add_source_points(angles, ray_ends, segment_ids, segments, rays[ray_ids], road_ids, left_angles, right_angles)
@@ -1,4 +1,6 @@
-from reflectionPath import ReflectionPath, read_buildings
+import numpy as np
+
+from reflectionPath import CandidateWalls, ReflectionPath
 
 
 class ReflectionManager:
@@ -6,7 +8,7 @@ class ReflectionManager:
     def __init__(self):
         self.reflection_paths = {}
     
-    def get_reflection_path(self, receiver_coords, source_list_per_ray, building_manager, tin, minimal_height_difference):
+    def get_reflection_path(self, receiver_coords, source_list_per_ray, building_manager, tin, minimal_height_difference, reflection_order=1):
         """
         Explanation: Finds cross-sections between the receiver and all source points in the source_list_per_ray dictionary.
         ---------------
@@ -14,30 +16,91 @@ class ReflectionManager:
             receiver_coords : (x,y,z) - the receiver point we walk from
             source_list_per_ray : {(ray_end): [source_points]} - A dictionary where all the source points are listed per outgoing ray from the receiver
             building_manager : BuildingManager - The manager that holds all the building information
+            reflection_order : integer - 1 for first order reflections only, 2 to add the second order reflections
         ---------------
         Output:
             void (fills self.reflection_paths with a list of paths)
         """
 
-        # Loop through all the source po ints from all outgoing rays from the receiver
-        for ray_end_point, source_point_list in source_list_per_ray.items():
-            # Loop through all the source points from one outoing ray from the receiver
-            for source_point in source_point_list:
+        # The walls facing the receiver are the same for all its sources, the reflections of all sources are searched at once
+        candidate_walls = CandidateWalls(receiver_coords, building_manager)
 
-                # Create a reflection path from source to receiver and get all possible reflections
-                reflection_object = ReflectionPath(source_point, receiver_coords)
-                at_least_one_reflection = reflection_object.get_first_order_reflection(building_manager, tin, minimal_height_difference)
+        # Sources at the same location (where a ray crosses the point two road segments share) have the same reflections,
+        # only the first source at every location is used for the search
+        ray_source_points = [(ray_end_point, source_point) for ray_end_point, source_point_list in source_list_per_ray.items()
+                             for source_point in source_point_list]
+        unique_sources = {}
+        for source_id, (ray_end_point, source_point) in enumerate(ray_source_points):
+            unique_sources.setdefault(tuple(source_point.source_coords[:2]), []).append(source_id)
+        unique_source_ids = [source_ids[0] for source_ids in unique_sources.values()]
+        unique_source_coords = [ray_source_points[source_id][1].source_coords for source_id in unique_source_ids]
 
-                # If at least 1 reflection was found, store it
-                if at_least_one_reflection:
-                    if receiver_coords not in self.reflection_paths.keys():
-                        self.reflection_paths[receiver_coords] = {}
-                    if ray_end_point not in self.reflection_paths[receiver_coords].keys():
-                        self.reflection_paths[receiver_coords][ray_end_point] = {}
+        # Mirror all sources of the receiver over all candidate walls at once
+        source_ids, candidates, reflection_points, mirror_points = candidate_walls.get_image_sources(unique_source_coords)
+        source_ids = [unique_source_ids[source_id] for source_id in source_ids]
 
-                    self.reflection_paths[receiver_coords][ray_end_point][source_point.source_coords] = reflection_object
-    
-    def get_reflection_paths(self, source_receivers_dict, building_manager, tin, minimal_height_difference):
+        # The size of the walls of all these reflections is checked at once
+        large_enough = candidate_walls.check_relative_sizes(
+            building_manager, [receiver_coords] * len(candidates), mirror_points, candidate_walls.wall_rows[candidates])
+
+        # Only the reflections that are left are checked on validity, per source
+        reflection_objects = {}
+        for source_id, candidate, reflection_point, valid in zip(source_ids, candidates, reflection_points, large_enough):
+            if not valid:
+                continue
+            if source_id not in reflection_objects:
+                reflection_objects[source_id] = ReflectionPath(ray_source_points[source_id][1], receiver_coords)
+            reflection_objects[source_id].add_first_order_reflection(
+                building_manager, tin, minimal_height_difference, candidate_walls, candidate, reflection_point)
+
+        # Second order reflections, with the image tree of the receiver
+        if reflection_order >= 2:
+            candidate_walls.build_image_tree(building_manager)
+            source_ids, nodes, reflection_points, mirror_points = candidate_walls.get_second_order_image_sources(unique_source_coords)
+            source_ids = [unique_source_ids[source_id] for source_id in source_ids]
+
+            # the second wall is seen from the receiver, the first wall from the receiver mirrored over the second wall
+            image_tree = candidate_walls.image_tree
+            nodes = np.array(nodes, dtype=np.int64)
+            mirror_points = np.array(mirror_points, dtype=float).reshape(-1, 2, 2)
+            second_large_enough = candidate_walls.check_relative_sizes(
+                building_manager, [receiver_coords] * len(nodes), mirror_points[:, 1],
+                candidate_walls.wall_rows[image_tree.node_parents[nodes]])
+            first_large_enough = candidate_walls.check_relative_sizes(
+                building_manager, image_tree.receiver_images[image_tree.node_parents[nodes]], mirror_points[:, 0],
+                image_tree.node_walls[nodes])
+
+            for source_id, node, points, valid in zip(source_ids, nodes, reflection_points, first_large_enough & second_large_enough):
+                if not valid:
+                    continue
+                if source_id not in reflection_objects:
+                    reflection_objects[source_id] = ReflectionPath(ray_source_points[source_id][1], receiver_coords)
+                reflection_objects[source_id].add_second_order_reflection(
+                    building_manager, tin, minimal_height_difference, candidate_walls, node, points)
+
+        # The sources at the same location get a copy of the reflections (the cross sections extend the lists)
+        for source_ids in unique_sources.values():
+            if source_ids[0] not in reflection_objects:
+                continue
+            found_reflections = reflection_objects[source_ids[0]]
+            for source_id in source_ids[1:]:
+                reflection_object = ReflectionPath(ray_source_points[source_id][1], receiver_coords)
+                reflection_object.reflection_points = [list(points) for points in found_reflections.reflection_points]
+                reflection_object.reflection_heights = [list(heights) for heights in found_reflections.reflection_heights]
+                reflection_objects[source_id] = reflection_object
+
+        for source_id, reflection_object in sorted(reflection_objects.items()):
+            # If at least 1 reflection was found, store it
+            if len(reflection_object.reflection_points) > 0:
+                ray_end_point, source_point = ray_source_points[source_id]
+                if receiver_coords not in self.reflection_paths.keys():
+                    self.reflection_paths[receiver_coords] = {}
+                if ray_end_point not in self.reflection_paths[receiver_coords].keys():
+                    self.reflection_paths[receiver_coords][ray_end_point] = {}
+
+                self.reflection_paths[receiver_coords][ray_end_point][source_point.source_coords] = reflection_object
+
+    def get_reflection_paths(self, source_receivers_dict, building_manager, tin, minimal_height_difference, reflection_order=1):
         """
         Explanation: Finds reflection points for all source - receiver sets.
         ---------------
@@ -46,10 +109,11 @@ class ReflectionManager:
             tin : GroundTin object - stores the DTM in a triangle datastructure
             ground_type_manager : GroundTypeManager object - stores all the groundtype objects
             building_filename : string - name of the builings shapefile, this will be deleted later. (TODO)
+            reflection_order : integer - 1 for first order reflections only, 2 to add the second order reflections
         ---------------
         Output:
             void (fills self.paths with a list of paths)
         """
         for receiver_coords, receiver in source_receivers_dict.items():
-            self.get_reflection_path(receiver_coords, receiver.source_points, building_manager, tin, minimal_height_difference)
+            self.get_reflection_path(receiver_coords, receiver.source_points, building_manager, tin, minimal_height_difference, reflection_order)
 
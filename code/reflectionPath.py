@@ -4,7 +4,10 @@ import misc
 import numpy as np
 import time
 
-from shapely.geometry import shape, Point
+from shapely.geometry import shape
+
+# The maximum number of source x wall pairs for which the reflections are computed at once
+IMAGE_SOURCE_BLOCK_SIZE = 2 ** 20
 
 class ReflectionPath:
 
@@ -35,17 +38,21 @@ class ReflectionPath:
         p_mirror_y = point[1] - 2 * line_parameters[1] * d
         return [p_mirror_x, p_mirror_y]
 
-    def check_validity(self, building_id, building_manager, tin, reflection_point, building_height, minimal_height_difference):
-        triangle_index_building = np.where(tin.attributes == building_id)
-        triangle_index_building = triangle_index_building[0][0]
+    def check_validity(self, building_id, building_manager, tin, reflection_point, building_height, minimal_height_difference, start_triangles=None, wall=None):
+        triangle_index_building = tin.building_triangles[building_id]
+        # Reflection points on the same wall are close together, start walking from the triangle found for the previous one
+        if start_triangles is not None and wall in start_triangles:
+            triangle_index_building = start_triangles[wall]
         #print("random tr index of building: {}".format(triangle_index_building))
         # find the triangle where the reflection point is in (it is on the line though.)
         reflection_triangle = tin.find_receiver_triangle(triangle_index_building, reflection_point)
-        #print("correct tr of building: {}".format(tin.attributes[reflection_triangle]))
+        if start_triangles is not None:
+            start_triangles[wall] = reflection_triangle
+        #print("correct tr of building: {}".format(tin.get_material(reflection_triangle)))
 
         # can be either on the building side, or on the outerside
         # If the triangle is on the inside, get the triangle on the outside
-        if(tin.attributes[reflection_triangle] == building_id):
+        if(tin.get_material(reflection_triangle)[1] == building_id):
             #print("triangle is on inside")
             # the triangle is on the inside of the building
             # now get neighbor
@@ -63,12 +70,12 @@ class ReflectionPath:
             nbs = [5, 3, 4]
             reflection_triangle = tin.trs[reflection_triangle][nbs[neighbor]]
 
-        #print("triangle type on outside: {}".format(tin.attributes[reflection_triangle]))
+        #print("triangle type on outside: {}".format(tin.get_material(reflection_triangle)))
         # we should have the correct triangle at hand
-        if(tin.attributes[reflection_triangle][0] == 'b'):
+        if(tin.in_building(reflection_triangle)):
             #print("other triangle is building")
             # it is a building
-            outside_building_height = building_manager.buildings[tin.attributes[reflection_triangle]].roof_level
+            outside_building_height = building_manager.buildings[tin.get_material(reflection_triangle)[1]].roof_level
             if(building_height - outside_building_height > minimal_height_difference):
                 # building is atleast 20 centimeters higher then
                 return True
@@ -78,405 +85,394 @@ class ReflectionPath:
             # not a building, so its fine (should be, there should not be buildings below ground level in the dataset)
             return True
 
-    def check_relative_size(self, wall_segments, building, point):
-        for wall_id in wall_segments:
-            other_wall = building.walls[wall_id]
-            intersection_point = misc.line_intersect(other_wall, [self.receiver, point])
-            if intersection_point != False:    
-                return True
-        return False
+    def add_first_order_reflection(self, building_manager, tin, minimal_height_difference, candidate_walls, candidate, reflection_point):
+        """
+        Explanation: Checks a reflection found by CandidateWalls.get_image_sources (of which the wall is large enough, see
+        CandidateWalls.check_relative_sizes), and stores it when there is no taller building in front of it.
+        ---------------
+        Input:
+        building_manager : BuildingManager object - stores all the building objects
+        tin : GroundTin object - stores the DTM in a triangle datastructure
+        minimal_height_difference : float - the height a building has to be above the building in front of it
+        candidate_walls : CandidateWalls - the walls facing the receiver
+        candidate : integer - the candidate wall of the reflection
+        reflection_point : (x, y) - the reflection point on the wall
+        ---------------
+        Output:
+        boolean - True if the reflection is stored
+        """
+        building_id = candidate_walls.building_ids[candidate]
+        building = building_manager.buildings[building_id]
 
-    def get_first_order_reflection(self, building_manager, tin, minimal_height_difference, radius_buffer=2000):
+        # Check if reflection is valid, ie if there is no other taller building in front.
+        if not self.check_validity(building_id, building_manager, tin, reflection_point, building.roof_level, minimal_height_difference,
+                                   candidate_walls.start_triangles, candidate_walls.wall_rows[candidate]):
+            return False
+
+        # If the reflection object is of sufficient size, and the reflection is valid, store it
+        self.reflection_points.append([reflection_point])
+        self.reflection_heights.append([building.roof_level])
+        return True
+
+    def add_second_order_reflection(self, building_manager, tin, minimal_height_difference, candidate_walls, node, reflection_points):
+        """
+        Explanation: Checks a second order reflection found by CandidateWalls.get_second_order_image_sources (of which both
+        walls are large enough, see CandidateWalls.check_relative_sizes), and stores it when there is no taller building
+        in front of the walls. The path goes from the receiver
+        to the reflection on the second wall (P2), to the reflection on the first wall (P1), to the source.
+        ---------------
+        Input:
+        building_manager : BuildingManager object - stores all the building objects
+        tin : GroundTin object - stores the DTM in a triangle datastructure
+        minimal_height_difference : float - the height a building has to be above the building in front of it
+        candidate_walls : CandidateWalls - the walls facing the receiver, with their image tree
+        node : integer - the node of the image tree (the pair of walls) of the reflection
+        reflection_points : [(x, y), (x, y)] - the reflection points P2 and P1
+        ---------------
+        Output:
+        boolean - True if the reflection is stored
+        """
+        image_tree = candidate_walls.image_tree
+        first_row = image_tree.node_walls[node]
+        second_row = candidate_walls.wall_rows[image_tree.node_parents[node]]
+        first_wall = building_manager.get_wall(first_row)
+        second_wall = building_manager.get_wall(second_row)
+
+        heights = []
+        for (building_id, wall_id), row, reflection_point in zip((second_wall, first_wall), (second_row, first_row), reflection_points):
+            building = building_manager.buildings[building_id]
+            if not self.check_validity(building_id, building_manager, tin, reflection_point, building.roof_level, minimal_height_difference,
+                                       candidate_walls.start_triangles, row):
+                return False
+            heights.append(building.roof_level)
+
+        self.reflection_points.append(list(reflection_points))
+        self.reflection_heights.append(heights)
+        return True
+
+    def get_first_order_reflection(self, building_manager, tin, minimal_height_difference, radius_buffer=2000, candidate_walls=None):
         """
         Explanation: A function that reads a buildings_dict and computes all possible first-ORDER reflection paths,
         according to the receivers and sources that are provided from main.py
         ---------------
         Input:
         buildings_dict : BuildingManager object - stores all the building objects
+        candidate_walls : CandidateWalls - the walls facing the receiver, they are found when not given
         ---------------
         Output:
         Stores reflection points, and their corresponding heights in the class.
         return True if reflections are found, False if not
         """
-        query_geom = Point(self.receiver).buffer(radius_buffer)  # 2000 m buffer around receiver
-        chosen_buildings = building_manager.buildings_tree.query(query_geom)
-        for chosen_building in chosen_buildings:
-            building_id = building_manager.polygon_id_to_building_id[id(chosen_building)]
-            building = building_manager.buildings[building_id]
-            
-            if building.underground:
-                continue
+        if candidate_walls is None:
+            candidate_walls = CandidateWalls(self.receiver, building_manager, radius_buffer)
 
-            number_of_walls = len(building.walls)
-            
-            for wall_id, wall in enumerate(building.walls):
-                test_r = misc.side_test(wall[0], wall[1], self.receiver)
-                test_s = misc.side_test(wall[0], wall[1], self.source.source_coords)
-
-                # COS: Not sure if this is actually true!!!!
-                if test_r > 0 and test_s > 0:  # This statement guarantees that the source and receiver are both on the outer side of the wall
-                    # Get the mirrored source over the wall segment
-                    s_mirror = self.get_mirror_point(misc.parametric_line_equation(wall[0], wall[1]))
-                    # find the intersection point, returns False is they do not intersect.
-                    reflection_point = misc.line_intersect(wall, [s_mirror, self.receiver])
-                    # ref is false if there is no reflection.
-                    if reflection_point:
-                        angle = 0.01745329252  # Hardcoded Angle in radians (1 degree or 2.pi / 360)
-
-                        # take the mirror point and check if reflection path is longer than 2Km
-                        receiver_array = np.array(self.receiver)
-                        mirrored_source_array = np.array(s_mirror)
-
-                        # check distance between reflection point and mirrored source
-                        reflection_point_array = np.array(reflection_point)
-                        dist = np.linalg.norm(reflection_point_array-mirrored_source_array)
-                        if dist <= 2000:
-
-                            # rotate the mirrored point 1 degree to the left and look for an intersection with the building
-                            left_point = misc.get_rotated_point(receiver_array, mirrored_source_array, angle)
-                            wall_adjusted_order_left = np.array(range(wall_id, number_of_walls + wall_id, 1)) % number_of_walls
-                            is_left_valid = self.check_relative_size(wall_adjusted_order_left, building, left_point)
-
-                            if is_left_valid:
-                                # rotate the mirrored point 1 degree to the right and look for an intersection with the building
-                                right_point = misc.get_rotated_point(receiver_array, mirrored_source_array, -angle)
-                                wall_adjusted_order_right = np.array(range(number_of_walls + wall_id, wall_id, -1)) % number_of_walls
-                                is_right_valid = self.check_relative_size(wall_adjusted_order_right, building, right_point)
-
-                                if is_right_valid:
-                                    # Check if reflection is valid, ie if there is no other taller building in front.
-                                    if(self.check_validity(building_id, building_manager, tin, reflection_point, building.roof_level, minimal_height_difference)):
-                                        # If the reflection object is of sufficient size, and the reflection is valid, store it
-                                        self.reflection_points.append([reflection_point])
-                                        self.reflection_heights.append([building.roof_level])
+        _, candidates, reflection_points, mirror_points = candidate_walls.get_image_sources([self.source.source_coords])
+        large_enough = candidate_walls.check_relative_sizes(building_manager, [self.receiver] * len(candidates), mirror_points, candidate_walls.wall_rows[candidates])
+        for candidate, reflection_point, valid in zip(candidates, reflection_points, large_enough):
+            if valid:
+                self.add_first_order_reflection(building_manager, tin, minimal_height_difference, candidate_walls, candidate, reflection_point)
 
         if len(self.reflection_points) > 0:
             return True
         return False
 
-# THE FUNCTIONS BELOW ARE NOT USED IN THE MAIN ALGORITHM AND WERE, THEREFORE, PUT OUTSIDE THE CLASS.
-# SINCE IT IS INTERESING TO KEEP THEM AS A RECORD OF THE CODING PROCESS, ESPECIALLY FOR WRITING THE FINAL REPORT, THEY ARE STILL STORED HERE.
-
-def get_closest_point(p1, parameters):
-    # THIS FUNCTION IS OUT-OF-DATE, SINCE WE ARE NOT WORKING WITH SECOND ORDER REFLECTIONS ANYMORE.
-    """
-    Explanation: A function that reads a point and the parameters of a line and returns the closest point of p1 on this line.
-    ---------------
-    Input:
-    p1: [x(float),y(float)] - The object point.
-    parameters: [a_norm(float),b_norm(float),c_norm(float)] - The a,b,c parameters of the normalised line equation.
-    ---------------
-    Output:
-    p_line: [x(float),y(float)] - The closest point of p1 that lies on the line segment.
-    """
-
-    """
-    # THE SIGNED DISTANCE D FROM P1 TO THE LINE L, I.E. THE ONE WITH THE PARAMETERS.
-    d = parameters[0]*p1[0] + parameters[1]*p1[1] + parameters[2]
-    p_line_x = p1[0] - parameters[0]*d
-    p_line_y = p1[1] - parameters[1]*d
-    return [p_line_x,p_line_y]
-    """
-
-def split_lineseg_n(n, lineseg):
-    # THIS FUNCTION IS OUT-OF-DATE, SINCE WE ARE NOT WORKING WITH SECOND ORDER REFLECTIONS ANYMORE.
-    """
-    Explanation: A function that takes a line segment and splits it into multiple sub-segments, according to a specific number.
-    ---------------
-    Input:
-    n: int - the number of line sub-segments in which lineseg will be divided into
-    lineseg: [[x1(float),y1(float)],[xn(float),yn(float)]] - the line segment in matter
-    ---------------
-    Output:
-    ref_list: [[x1(float),y1(float)],[x2(float),y2(float)],[x3(float),y3(float)].....[xn(float),yn(float)]] - a list of all vertices
-    of lineseg (polyline), including the two outermost and original ones.
-    """
-
-    """
-    delta_x = lineseg[1][0] - lineseg[0][0] # delta_x can be positive, negative or zero, depending on the direction of the line.
-    delta_y = lineseg[1][1] - lineseg[0][1] # delta_x can be positive, negative or zero, depending on the direction of the line.
-    vertex = lineseg[0]
-    ref_list = [vertex]
-    for number in range(n):
-        x = vertex[0] + delta_x/n
-        y = vertex[1] + delta_y/n
-        vertex = [x,y]
-        ref_list.append(vertex)
-    return ref_list
-    """
-
-def split_lineseg_dim(dim, lineseg):
-    # THIS FUNCTION IS OUT-OF-DATE, SINCE WE ARE NOT WORKING WITH SECOND ORDER REFLECTIONS ANYMORE.
-    """
-    Explanation: A function that takes a line segment and splits it into multiple sub-segments, each one of them with lenght = 'dim'
-    ---------------
-    Input:
-    dim: float - the length of each sub-segment in which lineseg will be divided into
-    lineseg: [[x1(float),y1(float)],[xn(float),yn(float)]] - the line segment in matter
-    ---------------
-    Output:
-    ref_list: [[x1(float),y1(float)],[x2(float),y2(float)],[x3(float),y3(float)].....[xn(float),yn(float)]] - a list of all vertices
-    of lineseg (polyline), including the two outermost and original ones.
-    """
-
-    """
-    delta_x = lineseg[1][0] - lineseg[0][0]
-    delta_y = lineseg[1][1] - lineseg[0][1]
-    length = math.sqrt(delta_x**2 + delta_y**2)
-    n = math.floor(length//dim)
-    ref_list = [lineseg[0]]
-    for number in range(n):
-        h = (number+1)*dim
-        x = ((h * delta_x) / length) + lineseg[0][0]
-        y = ((h * delta_y) / length) + lineseg[0][1]
-        inter = [x,y]
-        ref_list.append(inter)
-    if ref_list[(len(ref_list)-1)] == lineseg[1]:
-        pass
-    else:
-        ref_list.append(lineseg[1])
-    return ref_list
-    """
-
-def get_candidate_point(dim):
-    # THIS FUNCTION IS OUT-OF-DATE, SINCE WE ARE NOT WORKING WITH SECOND ORDER REFLECTIONS ANYMORE.
-    """
-    Explanation: A function that gets all the walls from f_dict and create candidate reflection points.
-    ---------------
-    Input:
-    dim: int - lenght of the segments in which the wall will be divided into.
-    ---------------
-    Output:
-    void
-    """
-
-    """
-    for bag_id in f_dict:
-        h_dak = f_dict[bag_id]['h_dak']
-        walls = f_dict[bag_id]['walls']
-        for wall in walls:
-            ref_list = self.split_lineseg_dim(dim,wall)
-            for point in ref_list:
-                point.append(h_dak)
-                candidate = [wall[0],point,wall[1]]
-                c_list.append(candidate)
-    """
-
-def get_second_order_reflection(s, r, t):
-    # THIS FUNCTION IS OUT-OF-DATE, SINCE WE ARE NOT WORKING WITH SECOND ORDER REFLECTIONS ANYMORE.
-    """
-    Explanation: A function that reads a source point and a receiver and computes all possible SECOND-ORDER reflection paths,
-    according to buildings that are stored in f_dict (separate dictionary)
-    ---------------
-    Input:
-    s: [x(float),y(float),(z)(float)] - source point.
-    r: [x(float),y(float),(z)(float)] - receiver point.
-    threshold t: float - the threshold distance from the receiver.
-    ---------------
-    Output:
-    A list of all (independent) point lists that are capable of reflecting the sound wave from source to receiver.:
-    l = [ [ [p11, p12], [p21, p22], [p31, p32], .... [pn1, pn2] ] , [ [h11, h12], [h21, h22], [h31, h32], .... [hn1, hn2] ]
-    such that:
-    pn(1)(2) = coordinates of the reflection point [x(float),y(float)]
-    hn = height value of the building in which the reflection point lies into (float)
-    the n-th element of "p_list" corresponds to the n-th element of "h_list".
-    """
+class CandidateWalls:
 
-    """
-    coords   = [ ]
-    heights  = [ ]
-    for candidate in c_list:
-        for bag_id in f_dict:
-            h_dak = f_dict[bag_id]['h_dak']
-            walls = f_dict[bag_id]['walls']
-            for wall in walls:
-                test_c = misc.side_test( wall[0], wall[1], candidate[1][:2]) #r[:2] makes the function to ignore an eventual 'z' value.
-                test_s = misc.side_test( wall[0], wall[1], s[:2]) #s[:2] makes the function to ignore an eventual 'z' value.
-                if test_c > 0 and test_s > 0: # This statement guarantees that S-REF and REF-CANDIDATE are entirely outside the polygon.
-                    s_mirror = self.get_mirror_point(s,self.get_parametric_line_equation(wall[0],wall[1]))
-                    b = self.line_intersect(wall,[s_mirror,candidate[1][:2]])
-                    if type(b) == list:
-                        test_b = misc.side_test( candidate[0], candidate[2], b[:2])
-                        test_r = misc.side_test( candidate[0], candidate[2], r[:2])
-                        if test_b > 0 and test_r > 0:
-                            b_mirror = self.get_mirror_point(b,self.get_parametric_line_equation(candidate[0], candidate[2]))
-                            dist = math.sqrt(((b_mirror[0]-candidate[1][0])**2)+((b_mirror[1]-candidate[1][1])**2))
-                            if dist > 0.1:
-                                if abs(misc.side_test( b_mirror, candidate[1][:2], r)) <= t:
-                                    # GET CLOSEST POINT FROM R TO B_MIRROR_CANDIDATE[1]
-                                    r_closest = self.get_closest_point(r,(self.get_parametric_line_equation(b_mirror,candidate[1])))
-                                    r_closest.append(r[2])
-                                    coords.append([b,candidate[1][:2]])
-                                    heights.append([h_dak,candidate[1][2]])
-                                    b_z = b
-                                    b_z.append(h_dak)
-                                    p2_list.append([s,b_z,candidate[1],r_closest])
-    print('2nd-order reflection. numer of paths:',len(coords))
-    return [ coords, heights ] #[ [ [p11, p12], [p21, p22], .... [pn1, pn2] ] , [ [h11, h12], [h21, h22], .... [hn1, hn2] ]
-    """
-
-def read_buildings(input_file):
-    # THIS FUNCTION IS OUT-OF-DATE, SINCE WE ARE NOT WORKING WITH SECOND ORDER REFLECTIONS ANYMORE.
-    # ATTENTION: THE CONTENT OF THIS FUNCTION HAS BEEN PLACED IN MAIN.PY AND BUILDINGMANAGER.PY
-    """
-    Explanation: A function that reads footprints and stores all walls as [p1,p2] and absolute heights (float) of these.
-    ---------------
-    Input:
-    input_file: a .gpkg file containing the footprints of the buildings.
-    dictionary: an empty 'f_dict' dictionary in __main__
-    ---------------
-    Output:
-    void.
-    """
-
-    """
-    dictionary = {}
-    with fiona.open(input_file) as layer:
-        for feature in layer:
-            bag_id = feature['properties']['bag_id']
-            dictionary[bag_id] = { }
-            z = feature['properties']['h_dak']
-            dictionary[bag_id]['h_dak'] = z
-            f_geom_coord = feature['geometry']['coordinates']
-            f_geom_type = feature['geometry']['type']
-            if f_geom_type == 'Polygon':
-                for polygon_index in range(len(f_geom_type)):
-                    polygon_object = f_geom_type[polygon_index]
-                    walls = []
-                    for coord_index in range(len(polygon_object[:(len(polygon_object)-1)])):
-                        a = list(polygon_object[coord_index])
-                        b = list(polygon_object[coord_index+1])
-                        wall_2D = [a[:len(a)-1],b[:len(b)-1]]
-                        walls.append(wall_2D)
-                    dictionary[bag_id]['walls'] = walls
-            if f_geom_type == 'MultiPolygon':
-                for multi_polygon_index in range(len(f_geom_coord)):
-                    multi_polygon_object = f_geom_coord[multi_polygon_index]
-                    for polygon_index in range(len(multi_polygon_object)):
-                        polygon_object = multi_polygon_object[polygon_index]
-                        walls = []
-                        for coord_index in range(len(polygon_object[:(len(polygon_object)-1)])):
-                            a = list(polygon_object[coord_index])
-                            b = list(polygon_object[coord_index+1])
-                            wall_2D = [a[:len(a)-1],b[:len(b)-1]]
-                            walls.append(wall_2D)
-                        dictionary[bag_id]['walls'] = walls
-    return dictionary
-    """
-
-def read_points(input_file, dictionary):
-    # THIS FUNCTION IS OUT-OF-DATE, SINCE WE ARE NOT WORKING WITH SECOND ORDER REFLECTIONS ANYMORE.
-    """
-    Explanation: A function that reads points and store their ids (int) and coordinates as [x,y].
-    ---------------
-    Input:
-    input_file: a .gpkg file containing the points (with z coordinates)
-    dictionary: an empty dictionary in __main__ (either s_dict for sources or r_dict for receivers)
-    ---------------
-    Output:
-    void.
-    """
-
-    """
-    with fiona.open(input_file) as layer:
-        for feature in layer:
-            source_id = feature['properties']['id']
-            p_geom_type = feature['geometry']['type']
-            p_geom_coord = feature['geometry']['coordinates']
-            if p_geom_type == 'Point':
-                coord_obj = list(p_geom_coord)
-            if p_geom_type == 'MultiPoint':
-                for point in p_geom_coord:
-                    coord_obj = list(point)
-            dictionary[source_id] = coord_obj
-    layer.close()
-    """
-
-def write_candidates(output_file, lista):
-    # THIS FUNCTION IS OUT-OF-DATE, SINCE WE ARE NOT WORKING WITH SECOND ORDER REFLECTIONS ANYMORE.
-    """
-    Explanation: A function that writes a CSV file with all candidate points. It is used for visualising these points in QGIS.
-    ---------------
-    Input:
-    output_file: the directory/name of the csv file to be created.
-    lista: a list containing all candidate points in the following schema:
-    [candidate_x, candidate_y, h_dak]
-    ---------------
-    Output:
-    void.
-    """
-
-    """
-    fout = open(output_file,'w')
-    line = 'fid \t geometry \n'
-    fout.write(str(line))
-    count = 0
-    for candidate in lista:
-        count += 1
-        line = '%d \t PointZ (%f %f %f) \n' % (count,candidate[1][0],candidate[1][1],candidate[1][2])
-        fout.write(line)
-    fout.close()
-    #PointZ (93539.68248698 441892 1.4)
-    """
+    def __init__(self, receiver, building_manager, radius_buffer=2000):
+        """
+        The walls that can reflect towards a receiver: the walls of the (not underground) buildings near the receiver
+        (found with the wall index of the building manager), of which the receiver is on the outer side. They only depend on the receiver, so they are found
+        once and used for all sources of the receiver. Per wall are stored: the end points, the parameters of the
+        normalised line equation and the building id.
+        """
+        self.receiver = receiver
+        self.radius_buffer = radius_buffer
+
+        # all walls (rows in the wall table of the building manager) of the buildings that are not underground,
+        # near the receiver, they can be the first wall of second order reflections
+        nearby_walls = building_manager.query_walls_radius(receiver, radius_buffer)
+        self.nearby_walls = nearby_walls[~building_manager.wall_underground[nearby_walls]]
+        # only built for second order reflections
+        self.image_tree = None
+        # per wall (row) the triangle of the last reflection point on it, to start the next walk in the tin from
+        self.start_triangles = {}
+
+        # COS: Not sure if this is actually true!!!!
+        # The receiver has to be on the outer side of the wall
+        test_r = misc.side_test(building_manager.wall_starts[self.nearby_walls].T, building_manager.wall_ends[self.nearby_walls].T, receiver)
+        self.wall_rows = self.nearby_walls[test_r > 0]
+
+        self.starts = building_manager.wall_starts[self.wall_rows]
+        self.ends = building_manager.wall_ends[self.wall_rows]
+        self.line_parameters = building_manager.wall_line_parameters[self.wall_rows].tolist()
+        self.building_ids = [building_manager.building_ids[building] for building in building_manager.wall_buildings[self.wall_rows].tolist()]
+
+    def __len__(self):
+        return len(self.wall_rows)
+
+    def get_image_sources(self, sources, max_distance=2000, block_size=IMAGE_SOURCE_BLOCK_SIZE):
+        """
+        Explanation: Finds the first order reflections of many sources with all candidate walls at once. A source is
+        mirrored over every wall that it is in front of, and the reflection point is the intersection of the wall with the
+        line from the mirrored source to the receiver. Reflections of which the mirrored source is more than max_distance
+        from the reflection point are dropped. The size and validity checks are not done here.
+        ---------------
+        Input:
+        sources : [[x, y], ...] - the source coordinates
+        max_distance : float - the maximum distance between the reflection point and the mirrored source
+        block_size : integer - the maximum number of source x wall pairs that is tested at once
+        ---------------
+        Output:
+        list - the index of the source of every reflection (sorted on source, then on candidate wall)
+        list - the candidate wall of every reflection
+        list - the reflection points (x, y)
+        list - the mirrored sources [x, y]
+        """
+        sources = np.array([source[:2] for source in sources], dtype=float).reshape(-1, 2)
+        source_ids, candidates, reflection_points, mirror_points = [], [], [], []
+        if len(self.wall_rows) == 0 or len(sources) == 0:
+            return source_ids, candidates, reflection_points, mirror_points
+
+        line_parameters = np.array(self.line_parameters, dtype=float)
+        receiver = np.array(self.receiver[:2], dtype=float)
+        sources_per_block = max(block_size // len(self.wall_rows), 1)
+        for first_source in range(0, len(sources), sources_per_block):
+            block = sources[first_source:first_source + sources_per_block, np.newaxis, :]
+
+            # the source has to be on the outer side of the wall as well
+            test_s = misc.side_test(self.starts.T, self.ends.T, block.transpose(2, 0, 1))
+            block_sources, block_walls = np.nonzero(test_s > 0)
+            pts = block[block_sources, 0]
+
+            # mirror the sources over the walls (see ReflectionPath.get_mirror_point)
+            parameters = line_parameters[block_walls]
+            d = parameters[:, 0] * pts[:, 0] + parameters[:, 1] * pts[:, 1] + parameters[:, 2]
+            mirrors = np.stack((pts[:, 0] - 2 * parameters[:, 0] * d, pts[:, 1] - 2 * parameters[:, 1] * d), axis=-1)
+
+            # intersect the walls with the lines from the mirrored sources to the receiver
+            points, intersects, _ = misc.batch_line_intersect(self.starts[block_walls], self.ends[block_walls], mirrors, receiver)
+            distance = np.sqrt(np.sum((points - mirrors) ** 2, axis=-1))
+            valid = intersects & (distance <= max_distance)
+
+            source_ids += (block_sources[valid] + first_source).tolist()
+            candidates += block_walls[valid].tolist()
+            reflection_points += [tuple(point) for point in points[valid].tolist()]
+            mirror_points += mirrors[valid].tolist()
+        return source_ids, candidates, reflection_points, mirror_points
+
+    def check_relative_sizes(self, building_manager, origins, mirror_points, walls, angle=0.01745329252):
+        """
+        Explanation: Checks for many reflections at once if the wall is large enough: the lines from the origin (the receiver)
+        to the mirrored source rotated 1 degree to the left and to the right both still have to hit the building of the wall.
+        ---------------
+        Input:
+        building_manager : BuildingManager object - stores all the building objects
+        origins : [[x, y], ...] - the point the reflected sound goes to, the receiver (or its image for an earlier reflection)
+        mirror_points : [[x, y], ...] - the source mirrored over the wall (and the walls before it)
+        walls : [...] - the rows of the walls in the wall table
+        angle : float - the rotation in radians (1 degree)
+        ---------------
+        Output:
+        (n,) boolean array - True where the wall is large enough
+        """
+        origins = np.array(origins, dtype=float).reshape(-1, 2)
+        mirror_points = np.array(mirror_points, dtype=float).reshape(-1, 2)
+        walls = np.asarray(walls, dtype=np.int64)
+        if len(walls) == 0:
+            return np.zeros(0, dtype=bool)
+
+        # the left and right rays of all reflections in one test
+        rotated = np.concatenate((misc.batch_rotated_points(origins, mirror_points, angle),
+                                  misc.batch_rotated_points(origins, mirror_points, -angle)))
+        buildings = np.tile(building_manager.wall_buildings[walls], 2)
+        hits = building_manager.rays_hit_buildings(np.concatenate((origins, origins)), rotated, buildings)
+        return hits[:len(walls)] & hits[len(walls):]
+
+    def build_image_tree(self, building_manager, max_distance=2000):
+        """
+        Explanation: Builds the image tree for second order reflections of this receiver, see ImageTree.
+        ---------------
+        Input:
+        building_manager : BuildingManager object - stores all the building objects
+        max_distance : float - the maximum length of a reflection path
+        ---------------
+        Output:
+        void (sets self.image_tree)
+        """
+        self.image_tree = ImageTree(self, building_manager, max_distance)
 
-def write_output_1st(output_file, lista):
-    # THIS FUNCTION IS OUT-OF-DATE, SINCE WE ARE NOT WORKING WITH SECOND ORDER REFLECTIONS ANYMORE.
-    """
-    Explanation: A function that writes a CSV file with the reflected paths. It is used for visualising the paths in QGIS.
+    def get_second_order_image_sources(self, sources, block_size=IMAGE_SOURCE_BLOCK_SIZE):
+        """
+        Explanation: Finds the second order reflections of many sources with all nodes (wall pairs) of the image tree at once.
+        The receiver is mirrored over the second wall (R') and then over the first wall (R''), the reflection point on the
+        first wall (P1) is where the line from the source to R'' crosses it, and the reflection point on the second wall (P2)
+        is where the line from P1 to R' crosses it. Every part of the path has to be on the outer side of the walls it leaves
+        and arrives at, and the path can not be longer than the max_distance of the image tree.
+        ---------------
+        Input:
+        sources : [[x, y], ...] - the source coordinates
+        block_size : integer - the maximum number of source x node pairs that is tested at once
+        ---------------
+        Output:
+        list - the index of the source of every reflection (sorted on source, then on node)
+        list - the node of every reflection
+        list - the reflection points [P2, P1] of every reflection
+        list - the source mirrored over the first wall, and then also over the second wall, of every reflection
+        """
+        image_tree = self.image_tree
+        sources = np.array([source[:2] for source in sources], dtype=float).reshape(-1, 2)
+        source_ids, nodes, reflection_points, mirror_points = [], [], [], []
+        node_count = len(image_tree.node_walls)
+        if node_count == 0 or len(sources) == 0:
+            return source_ids, nodes, reflection_points, mirror_points
+
+        first_starts = image_tree.starts[image_tree.node_walls]
+        first_ends = image_tree.ends[image_tree.node_walls]
+        first_parameters = image_tree.line_parameters[image_tree.node_walls]
+        parent_walls = self.wall_rows[image_tree.node_parents]
+        second_starts = image_tree.starts[parent_walls]
+        second_ends = image_tree.ends[parent_walls]
+        second_parameters = image_tree.line_parameters[parent_walls]
+        receiver_images = image_tree.receiver_images[image_tree.node_parents]
+
+        sources_per_block = max(block_size // node_count, 1)
+        for first_source in range(0, len(sources), sources_per_block):
+            block = sources[first_source:first_source + sources_per_block, np.newaxis, :]
+
+            # the source has to be in front of the first wall
+            test_s = misc.side_test(first_starts.T, first_ends.T, block.transpose(2, 0, 1))
+            block_sources, block_nodes = np.nonzero(test_s > 0)
+            pts = block[block_sources, 0]
+
+            # the path can not be longer than the max distance, its length is the distance from the source to R''
+            total_length = np.sqrt(np.sum((image_tree.node_images[block_nodes] - pts) ** 2, axis=-1))
+            keep = total_length <= image_tree.max_distance
+            block_sources, block_nodes, pts = block_sources[keep], block_nodes[keep], pts[keep]
+
+            # P1, on the first wall, it has to be in front of the second wall
+            p1, intersects, _ = misc.batch_line_intersect(first_starts[block_nodes], first_ends[block_nodes], pts, image_tree.node_images[block_nodes])
+            keep = intersects & (misc.side_test(second_starts[block_nodes].T, second_ends[block_nodes].T, p1.T) > 0)
+            block_sources, block_nodes, pts, p1 = block_sources[keep], block_nodes[keep], pts[keep], p1[keep]
+
+            # P2, on the second wall, it has to be in front of the first wall
+            p2, intersects, _ = misc.batch_line_intersect(second_starts[block_nodes], second_ends[block_nodes], p1, receiver_images[block_nodes])
+            keep = intersects & (misc.side_test(first_starts[block_nodes].T, first_ends[block_nodes].T, p2.T) > 0)
+            block_sources, block_nodes, pts, p1, p2 = block_sources[keep], block_nodes[keep], pts[keep], p1[keep], p2[keep]
+
+            # the source mirrored over the first wall, and then over the second wall (for the size check of the walls)
+            source_images = get_mirror_points(pts, first_parameters[block_nodes])
+            source_second_images = get_mirror_points(source_images, second_parameters[block_nodes])
+
+            source_ids += (block_sources + first_source).tolist()
+            nodes += block_nodes.tolist()
+            reflection_points += [[tuple(point_2), tuple(point_1)] for point_2, point_1 in zip(p2.tolist(), p1.tolist())]
+            mirror_points += [list(pair) for pair in zip(source_images.tolist(), source_second_images.tolist())]
+        return source_ids, nodes, reflection_points, mirror_points
+
+
+class ImageTree:
+
+    def __init__(self, candidate_walls, building_manager, max_distance=2000):
+        """
+        The image tree of the second order reflections of a receiver. The first level are the candidate walls facing the
+        receiver (the second wall of a path, the one seen from the receiver), with the receiver mirrored over them (R').
+        The children of a first level wall are the walls the reflected sound can hit: walls within the beam from R' through
+        the wall, limited to max_distance from R', that have the wall at least partly in front of them. These walls are
+        found with the wall index of the building manager, so the work depends on the number of visible wall pairs.
+        Every node (child) stores the first wall (a row in the wall table), its parent (a candidate wall) and R' mirrored
+        over the first wall (R'').
+        """
+        self.max_distance = max_distance
+        receiver = np.array(candidate_walls.receiver[:2], dtype=float)
+
+        # the wall table of the building manager, nodes refer to its rows
+        self.starts = building_manager.wall_starts
+        self.ends = building_manager.wall_ends
+        self.line_parameters = building_manager.wall_line_parameters
+
+        parent_walls = candidate_walls.wall_rows
+        self.receiver_images = get_mirror_points(np.repeat(receiver[np.newaxis], len(parent_walls), axis=0), self.line_parameters[parent_walls])
+        receiver_box = np.concatenate((receiver - max_distance, receiver + max_distance))
+
+        node_parents = []
+        node_walls = []
+        for parent, parent_wall in enumerate(parent_walls):
+            start, end, apex = self.starts[parent_wall], self.ends[parent_wall], self.receiver_images[parent]
+            beam_box = get_beam_bounding_box(apex, start, end, max_distance)
+            beam_box = np.concatenate((np.maximum(beam_box[:2], receiver_box[:2]), np.minimum(beam_box[2:], receiver_box[2:])))
+            if np.any(beam_box[:2] > beam_box[2:]):
+                continue
+            children = building_manager.query_walls(beam_box)
+            children = children[(children != parent_wall) & ~building_manager.wall_underground[children]]
+            child_starts, child_ends = self.starts[children], self.ends[children]
+
+            # the parent wall has to be (partly) in front of the child wall
+            facing_child = ((misc.side_test(child_starts.T, child_ends.T, start) > 0) |
+                            (misc.side_test(child_starts.T, child_ends.T, end) > 0))
+            # the child wall has to be (partly) in front of the parent wall
+            in_front = ((misc.side_test(start, end, child_starts.T) > 0) |
+                        (misc.side_test(start, end, child_ends.T) > 0))
+            # the child wall has to be (partly) between the beam edges R'-start and R'-end
+            orientation = np.sign(misc.side_test(apex, start, end))
+            inside_start = ((misc.side_test(apex, start, child_starts.T) * orientation >= 0) |
+                            (misc.side_test(apex, start, child_ends.T) * orientation >= 0))
+            inside_end = ((misc.side_test(apex, end, child_starts.T) * orientation <= 0) |
+                          (misc.side_test(apex, end, child_ends.T) * orientation <= 0))
+            children = children[facing_child & in_front & inside_start & inside_end]
+
+            node_parents += [parent] * len(children)
+            node_walls += children.tolist()
+
+        self.node_parents = np.array(node_parents, dtype=np.int64)
+        self.node_walls = np.array(node_walls, dtype=np.int64)
+        self.node_images = get_mirror_points(self.receiver_images[self.node_parents], self.line_parameters[self.node_walls])
+
+    def __len__(self):
+        return len(self.node_walls)
+
+def get_mirror_points(points, line_parameters):
+    """
+    Explanation: Batch version of ReflectionPath.get_mirror_point, mirrors points over lines.
     ---------------
     Input:
-    output_file: the directory/name of the csv file to be created.
-    lista: a list containing all the 1st order propagation paths in the following schema:
-    [ [source_x, source_y, source_z,] , [reflection_x, reflection_y, h_dak], [receiver_x, receiver_y, receiver_z] ]
+    points : (n, 2) array - the points
+    line_parameters : (n, 3) array - the a,b,c parameters of the normalised line equations
     ---------------
     Output:
-    void.
-    """
-
-    """
-    fout = open(output_file,'w')
-    line = 'fid \t geometry \n'
-    fout.write(str(line))
-    count = 0
-    for path in lista:
-        count += 1
-        sou = path[0]
-        ref = path[1]
-        rec = path[2]
-        line = '%d \t MultiLineStringZ ((%f %f %f, %f %f %f, %f %f %f)) \n' % (count,sou[0],sou[1],sou[2],ref[0],ref[1],0,rec[0],rec[1],rec[2]) 
-        fout.write(line)
-    fout.close()
-    #MultiLineStringZ ((93528.02305619 441927.11005859 2.5, 93567.67848824 441908.81858497 0, 93539.68248698 441892 1.4))
+    (n, 2) array - the mirrored points
     """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    line_parameters = np.asarray(line_parameters, dtype=float).reshape(-1, 3)
+    d = line_parameters[:, 0] * points[:, 0] + line_parameters[:, 1] * points[:, 1] + line_parameters[:, 2]
+    return np.stack((points[:, 0] - 2 * line_parameters[:, 0] * d, points[:, 1] - 2 * line_parameters[:, 1] * d), axis=-1)
 
-def write_output_2nd(output_file, lista):
-    # THIS FUNCTION IS OUT-OF-DATE, SINCE WE ARE NOT WORKING WITH SECOND ORDER REFLECTIONS ANYMORE.
+def get_beam_bounding_box(apex, start, end, radius):
     """
-    Explanation: A function that writes a CSV file with the reflected paths. It is used for visualising the paths in QGIS.
+    Explanation: The bounding box of a beam, the part of the circle around the apex between the rays from the apex through
+    start and end (less than half a circle).
     ---------------
     Input:
-    output_file: the directory/name of the csv file to be created.
-    lista: a list containing all the 1st order propagation paths in the following schema:
-    [ [source_x, source_y, source_z,] , [b_ref_x, b_ref_y, b_ref_z], [c_ref_x, c_ref_y, c_ref_z], [receiver_x, receiver_y, receiver_z] ]
+    apex : [x, y] - the centre of the circle
+    start, end : [x, y] - the points the edges of the beam go through
+    radius : float - the radius of the circle
     ---------------
     Output:
-    void.
-    """
-
-    """
-    fout = open(output_file,'w')
-    line = 'fid \t geometry \n'
-    fout.write(str(line))
-    count = 0
-    for path in lista:
-        # path = [s,b_z,candidate,r]
-        count += 1
-        sou =   path[0]
-        b_ref = path[1]
-        c_ref = path[2]
-        rec =   path[3]
-        line = '%d \t MultiLineStringZ ((%f %f %f, %f %f %f, %f %f %f, %f %f %f)) \n' % (count,sou[0],sou[1],sou[2],b_ref[0],b_ref[1],b_ref[2],c_ref[0],c_ref[1],c_ref[2],rec[0],rec[1],rec[2]) 
-        fout.write(line)
-    fout.close()
-    #MultiLineStringZ ((93528.02305619 441927.11005859 2.5, 93567.67848824 441908.81858497 0, 93539.68248698 441892 1.4))
-    """
+    [x_min, y_min, x_max, y_max] - the bounding box
+    """
+    apex = np.asarray(apex, dtype=float)
+    directions = np.array([start, end], dtype=float) - apex
+    lengths = np.hypot(directions[:, 0], directions[:, 1])
+    if np.any(lengths == 0):
+        return np.concatenate((apex - radius, apex + radius))
+    directions /= lengths[:, np.newaxis]
+    points = [apex, apex + radius * directions[0], apex + radius * directions[1]]
+
+    # the circle reaches further in the axis directions that are within the beam
+    def cross(u, v):
+        return u[0] * v[1] - u[1] * v[0]
+    orientation = cross(directions[0], directions[1])
+    for axis in ((1.0, 0.0), (0.0, 1.0), (-1.0, 0.0), (0.0, -1.0)):
+        if cross(directions[0], axis) * orientation >= 0 and cross(axis, directions[1]) * orientation >= 0:
+            points.append(apex + radius * np.array(axis))
+    points = np.array(points)
+    return np.concatenate((points.min(axis=0), points.max(axis=0)))
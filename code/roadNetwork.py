@@ -0,0 +1,217 @@
+import fiona
+import numpy as np
+import xml.etree.cElementTree as ET
+
+from gridIndex import GridIndex
+from pathlib import Path
+from shapely.geometry import LineString
+from shapely.strtree import STRtree
+
+
+GML_EXTENSIONS = [".gml", ".xml"]
+
+
+class PointBuffer:
+
+    def __init__(self, capacity = 1024):
+        """
+        A growing (n, 2) array of points, the capacity is doubled when it is full.
+        Lines are stored as consecutive points, self.line_ends holds the end (exclusive) of every line.
+        """
+        self.points = np.empty((capacity, 2), dtype=float)
+        self.size = 0
+        self.line_ends = []
+        self.line_emission_classes = []
+
+    def add_line(self, pts, emission_class = 0):
+        """
+        Explanation: Add a line, lines with less than two points are skipped.
+        ---------------
+        Input:
+            pts : (n, 2+) array - the points of the line, only x and y are used
+            emission_class : the emission class of the line
+        ---------------
+        Output: void
+        """
+        if len(pts) < 2:
+            return
+        if self.size + len(pts) > len(self.points):
+            capacity = max(2 * len(self.points), self.size + len(pts))
+            points = np.empty((capacity, 2), dtype=float)
+            points[:self.size] = self.points[:self.size]
+            self.points = points
+        self.points[self.size:self.size + len(pts)] = pts[:, :2]
+        self.size += len(pts)
+        self.line_ends.append(self.size)
+        self.line_emission_classes.append(emission_class)
+
+    def get_road_network(self):
+        """
+        Explanation: Create a RoadNetwork of the lines, every pair of consecutive points of a line is a segment
+        and the road id of a segment is the number of the line it is part of.
+        ---------------
+        Input: void
+        ---------------
+        Output:
+            RoadNetwork - the road segments
+        """
+        points = self.points[:self.size]
+        line_ends = np.array(self.line_ends, dtype=np.int64)
+
+        # a segment goes from point i to i + 1, unless point i + 1 starts a new line
+        valid = np.ones(max(self.size - 1, 0), dtype=bool)
+        valid[line_ends[:-1] - 1] = False
+        starts = np.nonzero(valid)[0]
+
+        segments = np.stack((points[starts], points[starts + 1]), axis=1)
+        road_ids = np.searchsorted(line_ends, starts, side='right')
+        emission_classes = np.array(self.line_emission_classes)[road_ids] if len(road_ids) > 0 else None
+        return RoadNetwork(segments, road_ids, emission_classes)
+
+
+class RoadNetwork:
+
+    def __init__(self, segments, road_ids=None, emission_classes=None):
+        """
+        All road line segments as one (n, 2, 2) array of start and end points, with per segment the id of the
+        road (polyline) it is part of and its emission class. A grid index over the segments is used to find the
+        segments near a receiver.
+        """
+        self.segments = np.asarray(segments, dtype=float).reshape(-1, 2, 2)
+        segment_count = len(self.segments)
+
+        if road_ids is None:
+            road_ids = np.arange(segment_count)
+        if emission_classes is None:
+            emission_classes = np.zeros(segment_count)
+        self.road_ids = np.asarray(road_ids, dtype=np.int64)
+        self.emission_classes = np.asarray(emission_classes)
+
+        bounding_boxes = np.concatenate((self.segments.min(axis=1), self.segments.max(axis=1)), axis=1)
+        self.index = GridIndex(bounding_boxes)
+
+        # Only created when the shapely version of the source finding is used
+        self.strtree = None
+
+    def __len__(self):
+        return len(self.segments)
+
+    def query_radius(self, pt, radius):
+        """
+        Explanation: Find the road segments of which the bounding box overlaps the bounding box of a circle.
+        ---------------
+        Input:
+            pt : (x, y) - the centre of the circle
+            radius : float - the radius of the circle
+        ---------------
+        Output:
+            numpy array - the ids of the road segments
+        """
+        return self.index.query_radius(pt, radius)
+
+    def get_strtree(self):
+        """
+        Explanation: Get a shapely STRtree with all road segments as LineStrings, it is created the first time.
+        ---------------
+        Input: void
+        ---------------
+        Output:
+            STRtree - the tree with all road segments
+        """
+        if self.strtree is None:
+            self.strtree = STRtree([LineString(segment) for segment in self.segments.tolist()])
+        return self.strtree
+
+
+def read_road_network(path, layer = None, emission_field = None):
+    """
+    Explanation: Read the road lines of a GML file or of a GeoPackage (or any other file fiona can read) into
+    a RoadNetwork. The file type is chosen on the extension.
+    ---------------
+    Input:
+        path : string - the path of the road file
+        layer : string - the layer with the roads, only for a GeoPackage (default: the first layer)
+        emission_field : string - the attribute with the emission class, only for a GeoPackage (default: class 0)
+    ---------------
+    Output:
+        RoadNetwork - all road line segments
+    """
+    if Path(path).suffix.lower() in GML_EXTENSIONS:
+        return read_gml(path)
+    return read_vector_layer(path, layer, emission_field)
+
+def read_gml(path):
+    """
+    Explanation: Read the road lines of a GML file without loading the whole document, every element is cleared
+    once it is read. Both gml:coordinates ("x,y x,y") and gml:posList ("x y x y", with srsDimension) are read.
+    ---------------
+    Input:
+        path : string - the path of the GML file
+    ---------------
+    Output:
+        RoadNetwork - all road line segments
+    """
+    point_buffer = PointBuffer()
+    # the srsDimension of the open elements, it is inherited by the elements inside them
+    dimensions = [2]
+    root = None
+
+    for event, element in ET.iterparse(path, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = element
+            dimensions.append(int(element.get("srsDimension", dimensions[-1])))
+            continue
+
+        dimension = dimensions.pop()
+        tag = element.tag.rsplit('}', 1)[-1]
+        if tag == "coordinates" and element.text:
+            text = element.text.strip()
+            # the number of values of the first tuple is the dimension
+            dimension = text.split(None, 1)[0].count(element.get("cs", ",")) + 1
+            values = np.fromstring(text.replace(element.get("cs", ","), " "), sep=" ")
+            point_buffer.add_line(values.reshape(-1, dimension))
+        elif tag == "posList" and element.text:
+            values = np.fromstring(element.text, sep=" ")
+            point_buffer.add_line(values.reshape(-1, dimension))
+
+        # the features are the children of the root, clear them when they are done
+        if len(dimensions) == 2:
+            root.clear()
+        else:
+            element.clear()
+
+    return point_buffer.get_road_network()
+
+def read_vector_layer(path, layer = None, emission_field = None):
+    """
+    Explanation: Read the (multi) line strings of a layer of a GeoPackage, or any other vector file fiona can read.
+    ---------------
+    Input:
+        path : string - the path of the file
+        layer : string - the layer with the roads (default: the first layer)
+        emission_field : string - the attribute with the emission class (default: class 0)
+    ---------------
+    Output:
+        RoadNetwork - all road line segments
+    """
+    point_buffer = PointBuffer()
+    with fiona.open(path, layer=layer) as roads:
+        for record in roads:
+            geometry = record['geometry']
+            if geometry is None:
+                continue
+            emission_class = 0
+            if emission_field is not None and record['properties'][emission_field] is not None:
+                emission_class = record['properties'][emission_field]
+
+            if geometry['type'] == "LineString":
+                lines = [geometry['coordinates']]
+            elif geometry['type'] == "MultiLineString":
+                lines = geometry['coordinates']
+            else:
+                continue
+            for line in lines:
+                point_buffer.add_line(np.array(line, dtype=float).reshape(len(line), -1), emission_class)
+
+    return point_buffer.get_road_network()
@@ -6,4 +6,7 @@ class SourcePoint:
         self.source_coords = source_coords
 
         self.left_length = 0
-        self.right_length = 0
\ No newline at end of file
+        self.right_length = 0
+
+        # id of the road segment in the RoadNetwork the source is on, if known
+        self.segment_id = -1
\ No newline at end of file
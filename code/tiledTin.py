@@ -0,0 +1,281 @@
+import groundTin as TIN
+import json
+import numpy as np
+import sys
+
+from collections import OrderedDict
+from groundTin import GroundTin
+from pathlib import Path
+
+TILE_INDEX_FILE_NAME = "tiles.json"
+DEFAULT_TILE_SIZE = 500.0
+DEFAULT_MEMORY_BUDGET = 2 * 1024 ** 3 # bytes
+
+
+class TileArray:
+
+    def __init__(self, tiled_tin, name, offsets):
+        """
+        A global (vertex or triangle) array of a tiled tin, of which the rows are split over the tiles.
+        The rows of tile i are the global ids offsets[i] up to offsets[i + 1].
+        Indexing it loads the tiles that hold the requested rows.
+        """
+        self.tiled_tin = tiled_tin
+        self.name = name
+        self.offsets = offsets
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, key):
+        """
+        Explanation: Get one or more rows of the array, only the first axis can be indexed with an integer,
+        an integer array or a slice. Other axes are applied to the result.
+        ---------------
+        Input:
+            key : integer / array / slice / tuple - the index
+        ---------------
+        Output:
+            numpy array - the selected rows
+        """
+        if isinstance(key, tuple):
+            return self[key[0]][key[1:]]
+
+        if isinstance(key, slice):
+            key = np.arange(*key.indices(len(self)))
+
+        if np.ndim(key) == 0:
+            key = int(key)
+            if key < 0:
+                key += len(self)
+            if key < 0 or key >= len(self):
+                raise IndexError("index {} is out of bounds for {} with size {}".format(key, self.name, len(self)))
+            tile_id = np.searchsorted(self.offsets, key, side='right') - 1
+            return getattr(self.tiled_tin.get_tile(tile_id), self.name)[key - self.offsets[tile_id]]
+
+        keys = np.asarray(key, dtype=np.int64)
+        keys = np.where(keys < 0, keys + len(self), keys)
+        flat_keys = keys.ravel()
+        tile_ids = np.searchsorted(self.offsets, flat_keys, side='right') - 1
+
+        result = None
+        for tile_id in np.unique(tile_ids):
+            selection = tile_ids == tile_id
+            tile_rows = getattr(self.tiled_tin.get_tile(tile_id), self.name)
+            rows = tile_rows[flat_keys[selection] - self.offsets[tile_id]]
+            if result is None:
+                result = np.empty((len(flat_keys),) + rows.shape[1:], dtype=rows.dtype)
+            result[selection] = rows
+
+        if result is None:
+            return np.zeros(keys.shape, dtype=np.int64)
+        return result.reshape(keys.shape + result.shape[1:])
+
+
+class TiledTin(GroundTin):
+
+    def __init__(self, folder, memory_budget = DEFAULT_MEMORY_BUDGET):
+        """
+        A tin that is split into square tiles (see write_tiles). Only the tiles that are used are loaded,
+        and the least recently used tiles are dropped when the loaded tiles take more than memory_budget bytes.
+        Triangle and vertex ids are global, so the walking code of GroundTin works over the tile boundaries.
+        """
+        self.folder = Path(folder)
+        with open(self.folder / TILE_INDEX_FILE_NAME, 'r') as index_file:
+            index = json.load(index_file)
+
+        self.tile_size = index["tile_size"]
+        self.origin = index["origin"]
+        self.tile_files = [tile["file"] for tile in index["tiles"]]
+        self.tile_keys = {(tile["column"], tile["row"]): i for i, tile in enumerate(index["tiles"])}
+        self.tile_centres = np.array([
+            (self.origin[0] + (tile["column"] + 0.5) * self.tile_size, self.origin[1] + (tile["row"] + 0.5) * self.tile_size)
+            for tile in index["tiles"]])
+
+        self.memory_budget = memory_budget
+        self.loaded_tiles = OrderedDict()
+        self.tile_memory = {}
+        self.loaded_memory = 0
+
+        self.vts = TileArray(self, "vts", np.array(index["vertex_offsets"], dtype=np.int64))
+        self.trs = TileArray(self, "trs", np.array(index["triangle_offsets"], dtype=np.int64))
+        self.attributes = TileArray(self, "attributes", self.trs.offsets)
+
+        self.attribute_names = np.array(index["attribute_names"], dtype=str)
+        self.attribute_materials = []
+        self.attribute_in_building = None
+        self.build_attribute_tables()
+        self.building_triangles = index["building_triangles"]
+
+        # every tile has its own kd tree and vertex index
+        self.kd_vts = None
+        self.vts_to_tr = TileArray(self, "vts_to_tr", self.vts.offsets)
+
+        self.bounding_box_3d = index["bounding_box_3d"]
+        self.bounding_box_2d = [self.bounding_box_3d[0], self.bounding_box_3d[1], self.bounding_box_3d[3], self.bounding_box_3d[4]]
+
+        # the walking tables of build_edge_equations are not available for a tiled tin, they would cover all tiles
+        self.triangle_vertices = None
+        self.edge_equations = None
+        self.edge_origin = None
+
+    def get_tile(self, tile_id):
+        """
+        Explanation: Get a tile, load it when it is not in memory, and drop the least recently used tiles when
+        the memory budget is exceeded.
+        ---------------
+        Input:
+            tile_id : integer - the id of the tile
+        ---------------
+        Output:
+            GroundTin - the tile, with global triangle and vertex ids in its triangles
+        """
+        tile_id = int(tile_id)
+        if tile_id in self.loaded_tiles:
+            self.loaded_tiles.move_to_end(tile_id)
+            return self.loaded_tiles[tile_id]
+
+        tile = TIN.read_from_binary(str(self.folder / self.tile_files[tile_id]))
+        memory = tile.vts.nbytes + tile.trs.nbytes + tile.attributes.nbytes + tile.vts_to_tr.nbytes
+        memory += tile.kd_vts.data.nbytes + tile.kd_vts.indices.nbytes
+
+        # Drop cold tiles, but always keep the tile that is asked for
+        while self.loaded_tiles and self.loaded_memory + memory > self.memory_budget:
+            old_tile_id, old_tile = self.loaded_tiles.popitem(last=False)
+            self.loaded_memory -= self.tile_memory.pop(old_tile_id)
+
+        self.loaded_tiles[tile_id] = tile
+        self.tile_memory[tile_id] = memory
+        self.loaded_memory += memory
+        return tile
+
+    def find_tile(self, pt):
+        """
+        Explanation: Find the tile the point is in, or the tile with the closest centre if it is outside all tiles.
+        ---------------
+        Input:
+            pt : [x,y(,z)] - the point
+        ---------------
+        Output:
+            integer - tile id
+        """
+        key = (int(np.floor((pt[0] - self.origin[0]) / self.tile_size)), int(np.floor((pt[1] - self.origin[1]) / self.tile_size)))
+        if key in self.tile_keys:
+            return self.tile_keys[key]
+        distances = np.sum((self.tile_centres - np.array(pt[:2])) ** 2, axis=1)
+        return int(np.argmin(distances))
+
+    def find_vts_near_pt(self, p_receiver):
+        """
+        Explanation: Find a triangle close to the point, one that is incident to the nearest vertex of its tile.
+        ---------------
+        Input:
+            p_receiver : [x,y(,z)] - The point to look for.
+        ---------------
+        Output:
+            integer - (global) triangle id of a triangle that uses the nearest vertex.
+        """
+        tile = self.get_tile(self.find_tile(p_receiver))
+        nearest_vts = tile.kd_vts.query(p_receiver[:2])[1]
+        return tile.vts_to_tr[nearest_vts]
+
+    def find_vts_near_pts(self, pts):
+        """
+        Explanation: Batch version of find_vts_near_pt, the points are looked up in the kd tree of their own tile.
+        ---------------
+        Input:
+            pts : (n, 2+) array - The points to look for.
+        ---------------
+        Output:
+            (n,) integer array - per point the (global) id of a triangle that uses the nearest vertex.
+        """
+        return np.array([self.find_vts_near_pt(pt) for pt in np.asarray(pts, dtype=float)], dtype=np.int64)
+
+def write_tiles(ground_tin, folder, tile_size = DEFAULT_TILE_SIZE):
+    """
+    Explanation: Split a tin into square tiles, every tile is written as a binary tin (tinb) file, and an index file
+    with the tile layout is written next to them. Triangles go to the tile their centroid is in, vertices to the
+    tile of the first triangle using them. Ids are renumbered so every tile holds a consecutive range of the
+    global triangle and vertex ids, the triangles keep the global ids of their vertices and neighbours.
+    ---------------
+    Input:
+        ground_tin : GroundTin - the tin to split
+        folder : string - the folder to write the tiles to
+        tile_size : float - the width and height of a tile
+    ---------------
+    Output: void
+    """
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+
+    vts = np.asarray(ground_tin.vts)
+    trs = np.asarray(ground_tin.trs)
+    origin = [float(np.floor(vts[:, 0].min())), float(np.floor(vts[:, 1].min()))]
+
+    # Find the tile (column, row) of each triangle, and number the tiles row by row
+    centroids = vts[trs[:, :3], :2].mean(axis=1)
+    cells = np.floor((centroids - origin) / tile_size).astype(np.int64)
+    tile_cells, tile_of_triangle = np.unique(cells[:, [1, 0]], axis=0, return_inverse=True)
+    tile_of_triangle = tile_of_triangle.ravel()
+
+    # New triangle ids, sorted by tile
+    triangle_order = np.argsort(tile_of_triangle, kind='stable')
+    new_triangle_id = np.empty(len(trs), dtype=np.int64)
+    new_triangle_id[triangle_order] = np.arange(len(trs))
+    sorted_tile_of_triangle = tile_of_triangle[triangle_order]
+
+    # Every vertex belongs to the tile of the first (new) triangle using it, vertices that are not used are dropped
+    first_triangle = np.full(len(vts), len(trs), dtype=np.int64)
+    np.minimum.at(first_triangle, trs[triangle_order, :3].ravel(), np.repeat(np.arange(len(trs)), 3))
+    used_vertices = np.nonzero(first_triangle < len(trs))[0]
+    tile_of_vertex = sorted_tile_of_triangle[first_triangle[used_vertices]]
+    vertex_order = used_vertices[np.argsort(tile_of_vertex, kind='stable')]
+    new_vertex_id = np.full(len(vts), -1, dtype=np.int64)
+    new_vertex_id[vertex_order] = np.arange(len(vertex_order))
+
+    # Renumber the triangles, -1 (no neighbour) stays -1
+    new_trs = trs[triangle_order].astype(np.int64)
+    new_trs[:, :3] = new_vertex_id[new_trs[:, :3]]
+    neighbours = new_trs[:, 3:]
+    new_trs[:, 3:] = np.where(neighbours >= 0, new_triangle_id[neighbours], -1)
+    new_attributes = np.asarray(ground_tin.attributes)[triangle_order]
+    new_vts_to_tr = first_triangle[vertex_order]
+
+    triangle_offsets = np.searchsorted(sorted_tile_of_triangle, np.arange(len(tile_cells) + 1))
+    vertex_offsets = np.searchsorted(np.sort(tile_of_vertex), np.arange(len(tile_cells) + 1))
+
+    tiles = []
+    for i, (row, column) in enumerate(tile_cells):
+        tr_start, tr_end = triangle_offsets[i], triangle_offsets[i + 1]
+        vts_start, vts_end = vertex_offsets[i], vertex_offsets[i + 1]
+        file_name = "tile_{}_{}.tinb".format(column, row)
+        TIN.write_binary(str(folder / file_name), vts[vertex_order[vts_start:vts_end]], new_trs[tr_start:tr_end],
+                         new_attributes[tr_start:tr_end], ground_tin.attribute_names, new_vts_to_tr[vts_start:vts_end])
+        tiles.append({"file": file_name, "column": int(column), "row": int(row)})
+
+    building_triangles = {building_id: int(new_triangle_id[tr]) for building_id, tr in ground_tin.building_triangles.items()}
+    index = {
+        "tile_size": tile_size,
+        "origin": origin,
+        "tiles": tiles,
+        "triangle_offsets": [int(offset) for offset in triangle_offsets],
+        "vertex_offsets": [int(offset) for offset in vertex_offsets],
+        "attribute_names": [str(name) for name in ground_tin.attribute_names],
+        "building_triangles": building_triangles,
+        "bounding_box_3d": [float(value) for value in np.concatenate((vts.min(axis=0), vts.max(axis=0)))]
+    }
+    with open(folder / TILE_INDEX_FILE_NAME, 'w') as index_file:
+        json.dump(index, index_file)
+
+if __name__ == "__main__":
+    # python tiledTin.py [constrained_tin (objp / tinb)] [output_folder] [tile_size]
+    tin_file_path = sys.argv[1]
+    if tin_file_path.endswith(".tinb"):
+        tin = TIN.read_from_binary(tin_file_path)
+    else:
+        tin = TIN.read_from_objp(tin_file_path)
+
+    tile_size = DEFAULT_TILE_SIZE
+    if len(sys.argv) > 3:
+        tile_size = float(sys.argv[3])
+    write_tiles(tin, sys.argv[2], tile_size)
@@ -5,7 +5,7 @@ class XmlParserManager:
     def __init__(self):
         self.prepared_paths = {}
 
-    def write_xml_files(self, cross_sections_manager, Lw, output_folder):
+    def write_xml_files(self, cross_sections_manager, Lw, output_folder, receiver_offset=0, append=False, keep_prepared_paths=True):
         """
         Explination: prepare cross sections for writing to xml, compute the noise level per section and then write them to xml.
         ---------------
@@ -13,11 +13,15 @@ class XmlParserManager:
             cross_section_maanger (dictionary) - holds all the cross sections per receiver
             Lw (dictionary) - dictionary holding the default noise values, type of source etc.
             output_folder (list) - the path to write the files to, split up into map items ("outut/", "xml/")
+            receiver_offset (integer) - the number of the first receiver, when the receivers are written in chunks
+            append (boolean) - add the receivers to the receiver_dict file, instead of overwriting it
+            keep_prepared_paths (boolean) - store the prepared paths in this class, turn off to free them after writing
         ---------------
-        Output: void (writes the xml files)
+        Output:
+            integer - the number of the next receiver, the receiver_offset of the next chunk
         """
 
-        j = 0
+        j = receiver_offset
         receivers = ""
 
         # Loop over each list of cross_sections per receiver.
@@ -26,12 +30,13 @@ class XmlParserManager:
             receivers += '{} {:.2f} {:.2f}\n'.format(j, receiver[0], receiver[1])
 
             # for optional continuous processing, store the prepared path in this class.
-            self.prepared_paths[receiver] = []
+            if keep_prepared_paths:
+                self.prepared_paths[receiver] = []
 
             # Loop over each cross_section
             for i, cross_section in enumerate(cross_sections):
                 extension = cross_section.extension
-                path = cross_section.vertices
+                path = cross_section.vertex_array
                 material = cross_section.materials
 
                 # Create an xml instance
@@ -45,11 +50,14 @@ class XmlParserManager:
                 # write the xml to the output file
                 output_file_path = "{}/path_{}_{}.xml".format(output_folder[1], j, i)
                 xml.write_xml(output_file_path, Lw, False)
-                self.prepared_paths[receiver].append(xml)
+                if keep_prepared_paths:
+                    self.prepared_paths[receiver].append(xml)
 
             j += 1
         
         # write the receivers to a text file so the receiver location can be retrieved after analyzing the xml file.
-        with open('{}/receiver_dict.txt'.format(output_folder[0]), 'w') as f:
+        with open('{}/receiver_dict.txt'.format(output_folder[0]), 'a' if append else 'w') as f:
             f.write(receivers)
 
+        return j
+